@@ -1,13 +1,39 @@
+import hmac
 import os
-
-from flask import Flask, render_template, request, flash, redirect, session, g, jsonify
+import time
+from datetime import datetime, timezone
+from hashlib import md5
+
+import click
+from flask import (Flask, Response, render_template, request, flash, redirect, session, g, jsonify, abort, url_for,
+                   stream_with_context)
+from sqlalchemy import inspect
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+from werkzeug.security import safe_join
 
 from forms import UserAddForm, LoginForm, UserEditForm
-from models import db, connect_db, User, Message, Follows
+import load
+import migrations
+from models import db, connect_db, passwords, User, Message, Follows, Likes, Timeline
+from suggest import UsernameIndex
+from caching import (UserSnapshotCache, TTLCache, FragmentCache, FragmentCacheExtension, AtomicBytecodeCache,
+                     snapshot, restore)
+from group_commit import GroupCommitter
+from passwords import PasswordQueueFull
+from assets import Assets, skipped_outputs
+from compression import GzipMiddleware, WhitespaceCollapse
 import pdb
 
 CURR_USER_KEY = "curr_user"
+MESSAGES_PER_PAGE = 20
+USERS_PER_PAGE = 24
+SUGGEST_LIMIT = 10
+# seconds a suggestion waits for a new worker's username index to load
+SUGGEST_LOAD_TIMEOUT = 2
+MESSAGE_MAX_LENGTH = Message.text.type.length
+MESSAGE_BATCH_LIMIT = 1000
+STREAM_CHUNK_SIZE = 10
 
 app = Flask(__name__)
 if __name__ == "__main__":
@@ -23,25 +49,446 @@ app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
 app.config['SESSION_COOKIE_HTTPONLY'] = False
+# flask.app otherwise inherits the root logger's WARNING, which would hide
+# the startup reports
+app.logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+# read the home page from the materialized timelines table; turn off to
+# query messages and follows directly (e.g. while timelines are rebuilt)
+app.config['TIMELINE_MATERIALIZED'] = os.environ.get('TIMELINE_MATERIALIZED', '1') == '1'
+# send the home and profile feeds as they render, loading messages from a
+# server-side cursor, rather than building the whole page first
+app.config['STREAM_FEEDS'] = os.environ.get('STREAM_FEEDS', '0') == '1'
+# seconds a worker may reuse its snapshot of the logged-in user; 0 disables
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 30))
+# seconds before a worker reloads its username typeahead index, picking up
+# users added or renamed through other workers; 0 loads it only once
+app.config['USERNAME_INDEX_TTL'] = int(os.environ.get('USERNAME_INDEX_TTL', 300))
+# characters of rendered messages each worker keeps for reuse; 0 disables
+app.config['FRAGMENT_CACHE_BYTES'] = int(os.environ.get('FRAGMENT_CACHE_BYTES', 16 * 1024 * 1024))
+
+# keep compiled templates on disk for the next worker to load
+app.config['JINJA_BYTECODE_CACHE'] = os.environ.get('JINJA_BYTECODE_CACHE', '1') == '1'
+# where to keep them; unset uses Jinja's private per-user temp directory.
+# A directory given here must belong to this user and be closed to others
+app.config['JINJA_CACHE_DIR'] = os.environ.get('JINJA_CACHE_DIR')
+# compile every template when a server worker starts (see start_worker)
+# rather than on its first request
+app.config['PRELOAD_TEMPLATES'] = os.environ.get('PRELOAD_TEMPLATES', '1') == '1'
+# /metrics describes the worker's internals, so callers must send
+# "Authorization: Bearer <METRICS_TOKEN>"; unset, /metrics is turned off
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')
+# gzip text responses of at least COMPRESS_MIN_SIZE bytes at COMPRESS_LEVEL
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+
+app.jinja_env.trim_blocks = True
+app.jinja_env.lstrip_blocks = True
+app.jinja_env.add_extension(WhitespaceCollapse)
+app.jinja_env.add_extension(FragmentCacheExtension)
+
+
+def use_bytecode_cache(directory=None):
+    """Keep compiled templates in `directory`, shared by all workers.
+
+    Cached bytecode is executed as it stands, so a directory others can
+    write to would let them run code in the app; such a directory is
+    refused.
+    """
+
+    if directory is not None:
+        info = os.stat(directory)
+        if info.st_uid != os.getuid() or info.st_mode & 0o022:
+            raise RuntimeError(f"JINJA_CACHE_DIR {directory} must be owned by this user "
+                               "and not writable by anyone else")
+
+    # the cache only checks the template source, so anything else that
+    # changes the compiled code has to change the file names
+    settings = repr((app.jinja_env.trim_blocks, app.jinja_env.lstrip_blocks, sorted(app.jinja_env.extensions)))
+    app.jinja_env.bytecode_cache = AtomicBytecodeCache(
+        directory, pattern=f'{md5(settings.encode()).hexdigest()[:8]}-%s.cache')
+
+
+def preload_templates():
+    """Compile every template now, so no request pays for it, and log how
+    many were compiled and how long that took."""
+
+    start = time.perf_counter()
+    names = [name for name in app.jinja_env.list_templates() if name.endswith('.html')]
+    for name in names:
+        app.jinja_env.get_template(name)
+    app.logger.info("preloaded %d templates in %.1f ms (bytecode cache: %s)",
+                    len(names), (time.perf_counter() - start) * 1000,
+                    'on' if app.jinja_env.bytecode_cache else 'off')
+
+
+app.wsgi_app = GzipMiddleware(app.wsgi_app, minimum_size=app.config['COMPRESS_MIN_SIZE'],
+                              level=app.config['COMPRESS_LEVEL'])
+
+if app.config['JINJA_BYTECODE_CACHE']:
+    use_bytecode_cache(app.config['JINJA_CACHE_DIR'])
 
 connect_db(app)
 
+# per-worker typeahead index; loaded in the background when the worker
+# starts and again every USERNAME_INDEX_TTL seconds
+username_index = UsernameIndex(ttl=app.config['USERNAME_INDEX_TTL'])
+
+# per-worker snapshots of logged-in users, so most requests skip the users lookup
+user_cache = UserSnapshotCache(ttl=app.config['USER_CACHE_TTL'])
+# left out of the snapshots: they change with every post, like and follow,
+# by other users too, so pages that show them read them fresh
+USER_COUNTERS = {'messages_count', 'following_count', 'followers_count', 'likes_count'}
+
+# per-worker rendered message list items, reused across viewers
+fragment_cache = FragmentCache(max_bytes=app.config['FRAGMENT_CACHE_BYTES'])
+app.jinja_env.fragment_cache = fragment_cache
+
+# answers to recent like requests by Idempotency-Key, so client retries are free
+idempotency_keys = TTLCache(ttl=300)
+
+
+def write_messages(rows):
+    """Insert and commit a group-commit batch of messages; return their ids."""
+
+    ids = Message.insert_many(db.session.connection(), rows)
+    db.session.commit()
+    return ids
+
+
+# coalesces /messages/new inserts into shared transactions when
+# GROUP_COMMIT_ENABLED is set
+message_writes = GroupCommitter(write_messages, app)
+
+# fingerprinted, precompressed static files built by `flask build-assets`
+assets = Assets(app)
+
+
+##############################################################################
+# HTTP caching policy
+
+# dynamic pages differ per user, so only the browser may keep them, and it
+# must check back each time (a cheap 304 where the view sends an ETag)
+REVALIDATE = 'private, no-cache'
+# other users' profiles may be reused by the browser for a short while
+PROFILE_CACHE = 'private, max-age=30'
+# static files whose URL carries a content fingerprint (?v=) never change
+IMMUTABLE = 'public, max-age=31536000, immutable'
+STATIC_REVALIDATE = 'public, no-cache'
+
+static_fingerprints = {}
+
+
+def cache_policy(policy):
+    """Set the Cache-Control header of a view's successful responses.
+
+    `policy` is a header value or a function of the view's arguments that
+    returns one. Views without a policy get REVALIDATE.
+    """
+
+    def decorate(view):
+        view.cache_policy = policy
+        return view
+    return decorate
+
+
+def profile_cache_policy(user_id):
+    # your own profile changes under you (edits, deleted messages, new
+    # follows), so it's always revalidated
+    return REVALIDATE if g.user and g.user.id == user_id else PROFILE_CACHE
+
+
+def static_name(path):
+    """The name under static/ that `path` refers to, or None.
+
+    `path` is a bare asset name ('app.js') or a /static/... URL; anything
+    else (other URLs, names that would leave static/) gives None. Only
+    the string is looked at, never the filesystem.
+    """
+
+    if path.startswith('/static/'):
+        name = path[len('/static/'):]
+    elif path.startswith('/') or ':' in path:
+        return None
+    else:
+        name = path
+
+    return name if safe_join(app.static_folder, name) is not None else None
+
+
+@app.template_global()
+def static_fingerprint(filename):
+    """Hash of the current contents of static file `filename`, or None if
+    there's no such file under static/."""
+
+    name = static_name(filename)
+    path = name and safe_join(app.static_folder, name)
+    if not path or not os.path.isfile(path):
+        return None
+
+    # one entry per static file, refreshed when the file changes
+    mtime = os.stat(path).st_mtime
+    entry = static_fingerprints.get(name)
+    if entry is None or entry[0] != mtime:
+        with open(path, 'rb') as f:
+            entry = static_fingerprints[name] = (mtime, md5(f.read()).hexdigest()[:12])
+    return entry[1]
+
+
+def static_url(filename):
+    """URL of a static file with a fingerprint of its contents, so it can be
+    cached for good and still be refetched when it changes."""
+
+    fingerprint = static_fingerprint(filename)
+    if fingerprint is None:
+        return filename
+    return url_for('static', filename=static_name(filename), v=fingerprint)
+
+
+@app.template_global()
+def asset_url(path):
+    """URL to load static file `path` from: its built copy once `flask
+    build-assets` has run, else static_url.
+
+    `path` may also be a stored image URL such as /static/images/...;
+    other URLs are returned unchanged, without touching the filesystem.
+    """
+
+    name = static_name(path) if path else None
+    if name is None:
+        return path
+
+    built = assets.lookup(name)
+    if built:
+        return url_for('built_asset', filename=built)
+    return static_url(name)
+
+
+@app.template_global()
+def asset_srcset(path):
+    """A srcset of the resized copies of static image `path`, or ''."""
+
+    name = static_name(path) if path else None
+    if name is None:
+        return ''
+
+    return ', '.join(f"{url_for('built_asset', filename=built)} {width}w"
+                     for built, width in assets.srcset(name))
+
+
+def asset_version():
+    """Hash of the built assets' manifest and every static file's
+    fingerprint; it changes whenever an asset URL on a page could."""
+
+    names = sorted(
+        os.path.relpath(os.path.join(root, filename), app.static_folder).replace(os.sep, '/')
+        for root, dirs, filenames in os.walk(app.static_folder)
+        if not os.path.abspath(root).startswith(os.path.abspath(assets.dist_dir))
+        for filename in filenames
+    )
+    return md5(repr((sorted(assets.files.items()), [static_fingerprint(name) for name in names]))
+               .encode()).hexdigest()
+
+
+@app.route('/assets/<path:filename>')
+@cache_policy(IMMUTABLE)
+def built_asset(filename):
+    """Serve a built static file, precompressed when the browser allows."""
+
+    return assets.send(filename, request.accept_encodings)
+
+
+##############################################################################
+# Feed pagination
+
+
+def encode_cursor(message):
+    """Turn the last message on a page into a `before` cursor."""
+
+    return f"{message.timestamp.isoformat()}_{message.id}"
+
+
+def decode_cursor(cursor):
+    """Parse a `before` cursor into a (timestamp, id) pair; 400 if malformed."""
+
+    try:
+        timestamp, message_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except ValueError:
+        abort(400)
+
+
+def load_authors(messages):
+    """Attach authors to any of `messages` whose `user` isn't loaded yet.
+
+    Authors fetched earlier in the request are kept on g and reused; the
+    rest are loaded together in one query rather than one per message.
+    """
+
+    authors = g.setdefault('authors', {})
+    unloaded = [message for message in messages if 'user' in inspect(message).unloaded]
+    missing = {message.user_id for message in unloaded} - authors.keys()
+
+    if missing:
+        for user in db.session.query(User).filter(User.id.in_(missing)):
+            authors[user.id] = user
+
+    for message in unloaded:
+        set_committed_value(message, 'user', authors.get(message.user_id))
+
+
+def liked_message_ids(messages):
+    """Return the ids g.user has liked, checking `messages` with one query.
+
+    Results accumulate on g, so templates can test `message.id in liked_ids`
+    in constant time without loading the user's whole likes collection.
+    """
+
+    liked = g.setdefault('liked_ids', set())
+    checked = g.setdefault('like_checked_ids', set())
+    unchecked = {message.id for message in messages} - checked
+
+    if unchecked:
+        liked |= Likes.liked_ids(g.user.id, unchecked)
+        checked |= unchecked
+
+    return liked
+
+
+class FeedPage:
+    """One page of a message feed, newest first.
+
+    Pages are keyed on the (timestamp, id) of the last message shown rather
+    than an OFFSET, so reading an older page costs the same as the first one.
+    """
+
+    def __init__(self, query, timestamp_col, id_col, per_page=MESSAGES_PER_PAGE):
+        cursor = request.args.get('before')
+        if cursor:
+            query = query.filter(db.tuple_(timestamp_col, id_col) < decode_cursor(cursor))
+
+        rows = query.order_by(timestamp_col.desc(), id_col.desc()).limit(per_page + 1).all()
+
+        self.messages = rows[:per_page]
+        load_authors(self.messages)
+        self.next_cursor = encode_cursor(self.messages[-1]) if len(rows) > per_page else None
+
+
+class StreamedFeedPage:
+    """A FeedPage whose messages are read from a server-side cursor while
+    the template loops over them.
+
+    Authors, liked state and like counts are loaded a chunk at a time, into
+    the same `liked_ids` set and `like_counts` dict handed to the template,
+    just before that chunk is rendered. `next_cursor` is only known once
+    the loop is done, so templates must read it after the loop.
+    """
+
+    def __init__(self, query, timestamp_col, id_col, per_page=MESSAGES_PER_PAGE, chunk_size=STREAM_CHUNK_SIZE):
+        cursor = request.args.get('before')
+        if cursor:
+            query = query.filter(db.tuple_(timestamp_col, id_col) < decode_cursor(cursor))
+
+        self._query = query.order_by(timestamp_col.desc(), id_col.desc()).limit(per_page + 1).yield_per(chunk_size)
+        self._per_page = per_page
+        self._chunk_size = chunk_size
+        self.next_cursor = None
+        self.liked_ids = liked_message_ids([])
+        self.like_counts = {}
+
+    @property
+    def messages(self):
+        chunk = []
+        for n, message in enumerate(self._query):
+            if n == self._per_page:
+                self.next_cursor = encode_cursor(previous)
+                break
+            chunk.append(message)
+            previous = message
+            if len(chunk) == self._chunk_size:
+                yield from self._hydrate(chunk)
+                chunk = []
+
+        yield from self._hydrate(chunk)
+
+    def _hydrate(self, chunk):
+        load_authors(chunk)
+        liked_message_ids(chunk)
+        self.like_counts.update(Message.like_counts([message.id for message in chunk]))
+        return chunk
+
+
+def stream_template(template_name, **context):
+    """Render a template as a stream, sending output as it's produced."""
+
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_CHUNK_SIZE)
+    return Response(stream_with_context(stream))
+
+
+def render_feed(template_name, query, timestamp_col, id_col, **context):
+    """Render a page of the message feed `query` with its like state and
+    counts, streaming it if STREAM_FEEDS is on."""
+
+    if app.config['STREAM_FEEDS']:
+        page = StreamedFeedPage(query, timestamp_col, id_col)
+        return stream_template(template_name, page=page, liked_ids=page.liked_ids,
+                               like_counts=page.like_counts, **context)
+
+    page = FeedPage(query, timestamp_col, id_col)
+    return render_template(template_name, page=page, liked_ids=liked_message_ids(page.messages),
+                           like_counts=Message.like_counts([message.id for message in page.messages]), **context)
+
 
 ##############################################################################
 # User signup/login/logout
 
 
+def load_usernames():
+    """Every username, for the typeahead index."""
+
+    return [username for (username,) in db.session.query(User.username)]
+
+
+def start_worker(concurrent=True):
+    """Get a server worker ready before it serves anything; gunicorn.conf.py
+    calls this once the worker has loaded the app, saying whether it
+    serves requests concurrently."""
+
+    message_writes.check_workers(concurrent)
+    if app.config['PRELOAD_TEMPLATES']:
+        preload_templates()
+    username_index.start(load_usernames, app)
+
+
 @app.before_request
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
-        # updating to more current syntax
-        g.user = db.session.query(User).get(session[CURR_USER_KEY])
+        g.user = load_current_user(session[CURR_USER_KEY])
 
     else:
         g.user = None
 
+def load_current_user(user_id):
+    """Return the logged-in user, from this worker's snapshot cache if fresh.
+
+    A cached snapshot is merged into the session without a SELECT;
+    relationships and the counters still load lazily if a page needs them.
+    """
+
+    values = user_cache.get(user_id)
+    if values is not None:
+        return restore(db.session, User, values)
+
+    version = user_cache.version(user_id)
+    # updating to more current syntax
+    user = db.session.query(User).get(user_id)
+    if user is not None:
+        user_cache.set(user_id, snapshot(user, exclude=USER_COUNTERS), version)
+    return user
+
 def do_login(user):
     """Log in user."""
 
@@ -97,6 +544,7 @@ def signup():
                 flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
+        username_index.add(user.username)
         do_login(user)
 
         return redirect("/")
@@ -120,6 +568,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # saves the upgraded hash if authenticate rehashed the password
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -156,16 +606,61 @@ def list_users():
     
     search = request.args.get('q')
 
+    # only the columns the cards show, rather than whole rows with password hashes
+    cards = db.session.query(User.id, User.username, User.image_url, User.header_image_url, User.bio)
+
     #updating to more current syntax
     if not search:
-        users = db.session.query(User).order_by(User.username).all()
+        after = request.args.get('after')
+        if after:
+            cards = cards.filter(User.username > after)
+        users = cards.order_by(User.username).limit(USERS_PER_PAGE + 1).all()
     else:
-        users = db.session.query(User).filter(User.username.like(f"%{search}%")).all()
+        page = max(request.args.get('page', 1, type=int), 1)
+        pattern = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        # ILIKE '%q%' is served by the trigram index; closest matches first
+        users = (cards.filter(User.username.ilike(f"%{pattern}%", escape='\\'))
+                 .order_by(db.func.similarity(User.username, search).desc(), User.username)
+                 .offset((page - 1) * USERS_PER_PAGE)
+                 .limit(USERS_PER_PAGE + 1)
+                 .all())
+
+    next_url = None
+    if len(users) > USERS_PER_PAGE:
+        users = users[:USERS_PER_PAGE]
+        if search:
+            next_url = url_for('list_users', q=search, page=page + 1)
+        else:
+            next_url = url_for('list_users', after=users[-1].username)
+
+    following_ids = g.user.following_ids(user.id for user in users)
+    return render_template('users/index.html', users=users, following_ids=following_ids, next_url=next_url)
+
+
+@app.route('/users/suggest')
+def suggest_usernames():
+    """Usernames starting with ?prefix=, as JSON, for search-as-you-type.
+
+    Answered from the in-memory index, never the database. At most
+    SUGGEST_LIMIT names are returned.
+    """
 
-    return render_template('users/index.html', users=users)
+    if not g.user:
+        return jsonify(error='unauthorized'), 401
+
+    # under servers without the start_worker hook (e.g. flask run) the
+    # first suggestion starts the index loading
+    username_index.start(load_usernames, app)
+    username_index.wait(SUGGEST_LOAD_TIMEOUT)
+
+    prefix = request.args.get('prefix', '')
+    limit = min(request.args.get('limit', SUGGEST_LIMIT, type=int), SUGGEST_LIMIT)
+
+    return jsonify(username_index.suggest(prefix, limit))
 
 
 @app.route('/users/<int:user_id>')
+@cache_policy(profile_cache_policy)
 def users_show(user_id):
     """Show user profile."""
     
@@ -178,9 +673,11 @@ def users_show(user_id):
     # snagging messages in order from the database;
     # user.messages won't be in order by default
     # also updating to more recent query syntax
-    messages = db.session.query(Message).filter(Message.user_id == user_id).order_by(Message.timestamp.desc()).limit(100).all()
-
-    return render_template('users/show.html', user=user, messages=messages)
+    return render_feed('users/show.html',
+                       db.session.query(Message)
+                       .options(db.selectinload(Message.user))
+                       .filter(Message.user_id == user_id),
+                       Message.timestamp, Message.id, user=user)
 
 
 @app.route('/users/<int:user_id>/following')
@@ -192,7 +689,8 @@ def show_following(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    following_ids = g.user.following_ids(followed.id for followed in user.following)
+    return render_template('users/following.html', user=user, following_ids=following_ids)
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -204,9 +702,11 @@ def users_followers(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    following_ids = g.user.following_ids(follower.id for follower in user.followers)
+    return render_template('users/followers.html', user=user, following_ids=following_ids)
 
 @app.route('/users/<int:user_id>/likes')
+@cache_policy(profile_cache_policy)
 def users_likes(user_id):
     """Show list of likes of this user"""
 
@@ -215,7 +715,14 @@ def users_likes(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/likes.html', user=user)
+    page = FeedPage(db.session.query(Message)
+                    .options(db.selectinload(Message.user))
+                    .join(Likes, Likes.message_id == Message.id)
+                    .filter(Likes.user_id == user_id),
+                    Message.timestamp, Message.id)
+
+    return render_template('users/likes.html', user=user, messages=page.messages, next_cursor=page.next_cursor,
+                           liked_ids=liked_message_ids(page.messages))
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -264,12 +771,15 @@ def profile():
         user = User.authenticate(g.user.username,
                                  form.password.data)
         if user:
+            old_username = user.username
             user.username = form.username.data
             user.email = form.email.data
             user.image_url = form.image_url.data
             user.header_image_url = form.header_image_url.data
             user.bio = form.bio.data
             user.location = form.location.data
+            # retires every cached rendering of the user's messages
+            user.profile_version = User.profile_version + 1
             try:
                 db.session.add(user)
                 db.session.commit()
@@ -280,6 +790,8 @@ def profile():
                 if "users_username_key" in str(e):
                     flash("Username already taken", 'danger')
                 return render_template('users/edit.html', form=form, user=g.user)
+            user_cache.invalidate(user.id)
+            username_index.rename(old_username, user.username)
             return redirect(f'/users/{user.id}')
         else: 
             flash('Invalid password. Please try again', 'danger')
@@ -298,23 +810,56 @@ def add_remove_likes(msg_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
     
-    user = db.session.query(User).get(g.user.id)
-    message = db.session.query(Message).get(msg_id)
-
-    if user.id != message.user.id:
-        if message not in user.likes:
-            user.likes.append(message)
-            db.session.add(user)
-            db.session.commit()
-            return jsonify('like added')
-        elif message in user.likes:
-            user.likes.remove(message)
-            db.session.add(user)
-            db.session.commit()
-            return jsonify('like removed')
+    # try to add the like, and if it already exists remove it instead:
+    # at most two single-row statements, however many likes the user has.
+    # Own or missing messages can be neither liked nor unliked.
+    if Likes.add(g.user.id, msg_id):
+        result = 'like added'
+    elif Likes.remove(g.user.id, msg_id):
+        result = 'like removed'
     else:
         return jsonify('request failed')
 
+    db.session.commit()
+    return jsonify(result)
+
+@app.route('/messages/<int:message_id>/like', methods=["PUT", "DELETE"])
+def message_like(message_id):
+    """Like (PUT) or unlike (DELETE) a message.
+
+    Unlike the add_like toggle, these are idempotent: repeating a request
+    leaves the same state and gets the same answer. Retries sent with the
+    same Idempotency-Key header are answered from this worker's record of
+    the first request without touching the database.
+    """
+
+    if not g.user:
+        return jsonify(error='unauthorized'), 401
+
+    key = request.headers.get('Idempotency-Key')
+    if key:
+        key = (g.user.id, key, request.method, message_id)
+        result = idempotency_keys.get(key)
+        if result is not None:
+            return jsonify(result)
+
+    if request.method == 'PUT':
+        changed = Likes.add(g.user.id, message_id)
+        if changed or Likes.liked_ids(g.user.id, [message_id]):
+            result = 'like added'
+        else:
+            result = 'request failed'
+    else:
+        changed = Likes.remove(g.user.id, message_id)
+        result = 'like removed'
+
+    if changed:
+        db.session.commit()
+
+    if key:
+        idempotency_keys.set(key, result)
+    return jsonify(result)
+
 @app.route('/users/delete', methods=["POST"])
 def delete_user():
     """Delete user."""
@@ -325,8 +870,11 @@ def delete_user():
 
     do_logout()
 
+    user_id, username = g.user.id, g.user.username
     db.session.delete(g.user)
     db.session.commit()
+    user_cache.invalidate(user_id)
+    username_index.remove(username)
 
     return redirect("/signup")
 
@@ -346,12 +894,45 @@ def messages_add():
 
     text = request.json['text']
     user_id = g.user.id
-    new_message = Message(text=text, user_id=user_id)
-    db.session.add(new_message)
-    db.session.commit()
+    if message_writes.enabled:
+        message_writes.submit({'text': text, 'user_id': user_id})
+    else:
+        new_message = Message(text=text, user_id=user_id)
+        db.session.add(new_message)
+        db.session.commit()
 
     return jsonify('message created')
 
+@app.route('/messages/batch', methods=["POST"])
+def messages_batch():
+    """Add many messages in one request.
+
+    Takes a JSON array of message texts and returns the new messages' ids,
+    in the same order. The batch is checked as a whole before anything is
+    saved, then inserted with one statement and one commit.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    texts = request.get_json(silent=True)
+    if not isinstance(texts, list) or not texts:
+        return jsonify(error='expected a non-empty array of message texts'), 400
+    if len(texts) > MESSAGE_BATCH_LIMIT:
+        return jsonify(error=f'at most {MESSAGE_BATCH_LIMIT} messages per batch'), 400
+
+    invalid = [i for i, text in enumerate(texts)
+               if not isinstance(text, str) or not text or len(text) > MESSAGE_MAX_LENGTH]
+    if invalid:
+        return jsonify(error=f'messages must be 1 to {MESSAGE_MAX_LENGTH} characters', invalid=invalid), 400
+
+    user_id = g.user.id
+    ids = Message.insert_many(db.session.connection(), [{'text': text, 'user_id': user_id} for text in texts])
+    db.session.commit()
+
+    return jsonify(ids=ids), 201
+
 @app.route('/messages/<int:message_id>', methods=["GET"])
 def messages_show(message_id):
     """Show a message."""
@@ -360,8 +941,24 @@ def messages_show(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get_or_404(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = Message.query.options(db.joinedload(Message.user)).get_or_404(message_id)
+    liked_ids = liked_message_ids([msg])
+
+    # a message never changes once posted, but the page also shows the
+    # author, the viewer's like button and nav bar, and asset URLs that
+    # change with each deploy, so those are part of the tag
+    etag = md5(repr((msg.id, msg.id in liked_ids, msg.user.username, msg.user.image_url,
+                     g.user.id, g.user.profile_version, g.user.username, g.user.image_url,
+                     asset_version())).encode()).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.make_response(render_template('messages/show.html', message=msg, liked_ids=liked_ids))
+
+    response.set_etag(etag)
+    # timestamps are stored as naive server-local time; HTTP dates are UTC
+    response.last_modified = msg.timestamp.astimezone(timezone.utc)
+    return response
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -374,15 +971,80 @@ def messages_destroy(message_id):
 
     # updating to more current query syntax
     msg = db.session.query(Message).get(message_id)
-    if g.user.id != msg.user.id:
+    if g.user.id != msg.user_id:
         flash('Access unauthorized!', "danger")
         return redirect(f'/users/{g.user.id}')
     db.session.delete(msg)
     db.session.commit()
+    fragment_cache.invalidate(('message', message_id))
 
     return redirect(f"/users/{g.user.id}")
 
 
+##############################################################################
+# JSON feed API:
+
+
+def feed_json(page):
+    """A FeedPage as compact JSON, answered with 304 if the client's ETag
+    still matches.
+
+    Messages carry only their author's id; each author's details appear
+    once, in `users`. `next` is the cursor for the following page.
+    """
+
+    messages = []
+    users = {}
+    for message in page.messages:
+        messages.append({'id': message.id, 'text': message.text,
+                         'ts': message.timestamp.isoformat(), 'user_id': message.user_id})
+        if message.user_id not in users:
+            users[message.user_id] = {'username': message.user.username, 'image_url': message.user.image_url}
+
+    response = jsonify(messages=messages, users=users, next=page.next_cursor)
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@app.route('/api/timeline')
+def api_timeline():
+    """The logged-in user's home feed, as JSON; older pages via ?before=."""
+
+    if not g.user:
+        return jsonify(error='unauthorized'), 401
+
+    return feed_json(FeedPage(*home_timeline(g.user.id)))
+
+
+@app.route('/api/users/<int:user_id>/messages')
+def api_user_messages(user_id):
+    """A user's messages, as JSON; older pages via ?before=."""
+
+    if not g.user:
+        return jsonify(error='unauthorized'), 401
+
+    User.query.get_or_404(user_id)
+    return feed_json(FeedPage(db.session.query(Message)
+                              .options(db.selectinload(Message.user))
+                              .filter(Message.user_id == user_id),
+                              Message.timestamp, Message.id))
+
+
+@app.route('/api/users/<int:user_id>/likes')
+def api_user_likes(user_id):
+    """The messages a user has liked, as JSON; older pages via ?before=."""
+
+    if not g.user:
+        return jsonify(error='unauthorized'), 401
+
+    User.query.get_or_404(user_id)
+    return feed_json(FeedPage(db.session.query(Message)
+                              .options(db.selectinload(Message.user))
+                              .join(Likes, Likes.message_id == Message.id)
+                              .filter(Likes.user_id == user_id),
+                              Message.timestamp, Message.id))
+
+
 ##############################################################################
 # Homepage and error pages
 
@@ -392,41 +1054,170 @@ def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: a page of the most recent messages of followed_users,
+      older pages via ?before=<cursor>
     """
 
     if g.user:
-        #updating to more recent syntax
-        followed_users =[follows.user_being_followed_id for follows in db.session.query(Follows).filter(Follows.user_following_id == g.user.id).all()]
-        messages = db.session.query(Message).filter((Message.user_id.in_(followed_users)) | (Message.user_id == g.user.id)).order_by(Message.timestamp.desc()).limit(100).all()
-
-        return render_template('home.html', messages=messages)
+        return render_feed('home.html', *home_timeline(g.user.id))
 
     else:
         return render_template('home-anon.html')
 
+
+def home_timeline(user_id):
+    """The query for `user_id`'s home feed, with the columns it's ordered by."""
+
+    # reading the materialized timeline is one indexed range scan,
+    # no matter how many users the user follows
+    if app.config['TIMELINE_MATERIALIZED']:
+        return (db.session.query(Message)
+                .options(db.selectinload(Message.user))
+                .join(Timeline, Timeline.message_id == Message.id)
+                .filter(Timeline.user_id == user_id),
+                Timeline.timestamp, Timeline.message_id)
+    else:
+        return (Message.timeline_for(user_id).options(db.selectinload(Message.user)),
+                Message.timestamp, Message.id)
+
+@app.route('/metrics')
+def metrics():
+    """Queue depth, latency and batch sizes of this worker's background
+    pools, as JSON, for callers holding METRICS_TOKEN only.
+
+    The caller's address proves nothing behind a reverse proxy on the same
+    host, so a shared token is required instead.
+    """
+
+    token = app.config['METRICS_TOKEN']
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify(error='unauthorized'), 401
+
+    return jsonify(password_pool=passwords.stats(), group_commit=message_writes.stats())
+
+
 @app.errorhandler(404)
 def page_not_found(error):
     """Custom 404 page"""
     return render_template('404.html'), 404
 
 
+@app.errorhandler(PasswordQueueFull)
+def password_queue_full(error):
+    """Too many logins and signups at once: ask the client to come back."""
+    return "Too many people are logging in right now; please try again in a moment.", 503, {'Retry-After': '5'}
+
+
+##############################################################################
+# Maintenance commands
+
+
+@app.cli.command('build-assets')
+def build_assets():
+    """Build fingerprinted, precompressed copies of the static files into static/dist."""
+
+    manifest = assets.build()
+    print(f"built {len(manifest['files'])} files, resized {len(manifest['variants'])} images")
+    for skipped in skipped_outputs():
+        print(f"skipped {skipped}")
+
+
+@app.cli.command('load-fixtures')
+@click.option('--directory', default='generator', help='Folder holding users.csv, messages.csv and follows.csv.')
+@click.option('--workers', default=2, help='Tables loaded and indexes built at once.')
+def load_fixtures(directory, workers):
+    """Replace the users, messages and follows with the CSV fixtures, using COPY."""
+
+    with db.engine.connect() as connection:
+        migrations.upgrade(connection)
+
+    load.load(db.engine, directory, workers)
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines():
+    """Rebuild every user's home timeline from the follows and messages tables."""
+
+    Timeline.rebuild(db.session.connection())
+    db.session.commit()
+
+
+@app.cli.command('migrate')
+def migrate():
+    """Apply pending schema migrations."""
+
+    with db.engine.connect() as connection:
+        applied = migrations.upgrade(connection)
+
+    for version, description in applied:
+        print(f"applied {version}: {description}")
+    if not applied:
+        print("database is up to date")
+
+
+@app.cli.command('check-indexes')
+def check_indexes():
+    """Report indexes the models expect that are missing from the database."""
+
+    with db.engine.connect() as connection:
+        missing = migrations.missing_indexes(connection)
+
+    for table, index in missing:
+        print(f"missing index {index} on {table}")
+    if missing:
+        raise SystemExit(1)
+    print("all indexes present")
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters():
+    """Recompute every user's message, follow and like counters and every
+    message's like count."""
+
+    User.reconcile_counters(db.session.connection())
+    Message.reconcile_like_counts(db.session.connection())
+    db.session.commit()
+
+
+@app.cli.command('fold-like-counts')
+def fold_like_counts():
+    """Fold hot messages' like count shards back into messages.like_count."""
+
+    Message.fold_like_counts(db.session.connection())
+    db.session.commit()
+
+
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
+# Cache headers
+
 
 @app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+def set_cache_headers(response):
+    """Set Cache-Control from the view's cache_policy.
+
+    Static files requested with their current fingerprint are cached for
+    good, other static files are revalidated, and redirects and errors are never reused.
+    """
+
+    if response.status_code not in (200, 304):
+        policy = REVALIDATE
+    elif request.endpoint == 'static':
+        # only the file the fingerprint was made from may be kept for good;
+        # an old worker mid-deploy or a made-up ?v= gets the plain policy
+        fingerprint = request.args.get('v')
+        if fingerprint and fingerprint == static_fingerprint(request.view_args['filename']):
+            policy = IMMUTABLE
+        else:
+            policy = STATIC_REVALIDATE
+    else:
+        policy = getattr(app.view_functions.get(request.endpoint), 'cache_policy', REVALIDATE)
+        if callable(policy):
+            policy = policy(**request.view_args)
+
+    response.headers['Cache-Control'] = policy
+    return response
 
 
 # 15 fix likes on render site
@@ -0,0 +1,185 @@
+"""Content-hashed, precompressed copies of the static files.
+
+`flask build-assets` copies every file under static/ into static/dist with
+a hash of its contents in its name (app.js -> app.3f2a9c1b0d4e.js), so the
+copies can be cached for good. Text files also get .gz and, when the
+brotli package is installed, .br siblings, which /assets/ sends instead
+of the original when the browser accepts them. With Pillow installed, the
+hero images get resized copies at HERO_WIDTHS for srcset. Stylesheets'
+url("/static/...") references are rewritten to the built names.
+
+dist/manifest.json maps source names to built names; until it exists the
+templates fall back to the plain static files.
+"""
+
+import gzip
+import json
+import mimetypes
+import os
+import shutil
+from hashlib import md5
+from io import BytesIO
+
+from flask import safe_join, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.ico'}
+HERO_IMAGES = ['images/warbler-hero.jpg', 'images/signed-out-home.jpg']
+HERO_WIDTHS = [480, 960, 1920]
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def skipped_outputs():
+    """What the build leaves out because an optional package is missing."""
+
+    skipped = []
+    if brotli is None:
+        skipped.append('brotli (.br) copies: the Brotli package is not installed')
+    if Image is None:
+        skipped.append('resized hero images: the Pillow package is not installed')
+    return skipped
+
+
+class Assets:
+    """Flask extension that builds, looks up and serves built assets."""
+
+    def __init__(self, app=None):
+        self.static_dir = None
+        self.dist_dir = None
+        self.files = {}
+        self.variants = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.static_dir = app.static_folder
+        self.dist_dir = os.path.join(app.static_folder, 'dist')
+        self.load()
+
+    def load(self):
+        """Read the manifest left by the last build, if there is one."""
+
+        try:
+            with open(os.path.join(self.dist_dir, 'manifest.json')) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+
+        self.files = manifest.get('files', {})
+        self.variants = {name: {int(width): built for width, built in widths.items()}
+                         for name, widths in manifest.get('variants', {}).items()}
+
+    def lookup(self, name):
+        """The built name of static file `name`, or None if it wasn't built."""
+
+        return self.files.get(name)
+
+    def srcset(self, name):
+        """(built name, width) pairs of `name`'s resized copies, narrowest first."""
+
+        return sorted(((built, width) for width, built in self.variants.get(name, {}).items()),
+                      key=lambda variant: variant[1])
+
+    def build(self):
+        """Rebuild static/dist from static/; return the new manifest."""
+
+        shutil.rmtree(self.dist_dir, ignore_errors=True)
+        files = {}
+        variants = {}
+
+        sources = sorted(
+            os.path.relpath(os.path.join(root, filename), self.static_dir).replace(os.sep, '/')
+            for root, dirs, filenames in os.walk(self.static_dir)
+            if not os.path.abspath(root).startswith(os.path.abspath(self.dist_dir))
+            for filename in filenames
+        )
+
+        # stylesheets go last, so the files they refer to already have
+        # built names to rewrite to
+        for name in sorted(sources, key=lambda name: name.endswith('.css')):
+            with open(os.path.join(self.static_dir, name), 'rb') as f:
+                data = f.read()
+
+            if name.endswith('.css'):
+                data = self._rewrite_urls(data.decode('utf-8'), files, variants).encode('utf-8')
+            files[name] = self._write(name, data)
+
+            if name in HERO_IMAGES and Image is not None:
+                variants[name] = {width: self._write(self._variant_name(name, width), resized)
+                                  for width, resized in self._resize(name)}
+
+        with open(os.path.join(self.dist_dir, 'manifest.json'), 'w') as f:
+            json.dump({'files': files, 'variants': variants}, f, indent=2, sort_keys=True)
+
+        self.load()
+        return {'files': files, 'variants': variants}
+
+    def send(self, filename, accept_encodings):
+        """Send built file `filename`, precompressed if the browser accepts it."""
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+        for encoding, suffix in ENCODINGS:
+            if accept_encodings[encoding] and os.path.isfile(safe_join(self.dist_dir, filename + suffix)):
+                response = send_from_directory(self.dist_dir, filename + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(self.dist_dir, filename, mimetype=mimetype)
+
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def _write(self, name, data):
+        root, ext = os.path.splitext(name)
+        built = f'{root}.{md5(data).hexdigest()[:12]}{ext}'
+        path = os.path.join(self.dist_dir, built)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        if ext in COMPRESSIBLE:
+            self._write_smaller(path + '.gz', data, gzip.compress(data, compresslevel=9))
+            if brotli is not None:
+                self._write_smaller(path + '.br', data, brotli.compress(data))
+
+        return built
+
+    def _write_smaller(self, path, data, compressed):
+        # tiny files can come out bigger; then there's no point sending them
+        if len(compressed) < len(data):
+            with open(path, 'wb') as f:
+                f.write(compressed)
+
+    def _resize(self, name):
+        with Image.open(os.path.join(self.static_dir, name)) as image:
+            for width in HERO_WIDTHS:
+                if width >= image.width:
+                    continue
+                height = round(image.height * width / image.width)
+                out = BytesIO()
+                image.resize((width, height), Image.LANCZOS).save(
+                    out, format=image.format, quality=80, optimize=True, progressive=True)
+                yield width, out.getvalue()
+
+    def _variant_name(self, name, width):
+        root, ext = os.path.splitext(name)
+        return f'{root}-{width}{ext}'
+
+    def _rewrite_urls(self, css, files, variants):
+        for name, built in files.items():
+            # backgrounds are drawn full-width, so only the widest copy will do
+            built = variants.get(name, {}).get(max(HERO_WIDTHS), built)
+            css = css.replace(f'/static/{name}', f'/assets/{built}')
+        return css
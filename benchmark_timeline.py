@@ -0,0 +1,109 @@
+"""Benchmark the home feed query shapes against growing follow counts.
+
+Compares, for a reader following 10, 1k and 10k users:
+
+- python-list: the old approach, fetching followed ids into Python and
+  sending them back as an IN (...) literal list
+- timeline_for: Message.timeline_for, one statement with a follows subquery
+- materialized: a range read of the timelines table
+
+Run against a scratch database (it creates and removes its own rows):
+
+    DATABASE_URL=postgresql:///warbler-test python benchmark_timeline.py
+"""
+
+import os
+import statistics
+import time
+from datetime import datetime
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import app
+from models import db, User, Message, Follows, Timeline
+
+FOLLOWEE_COUNTS = (10, 1000, 10000)
+MESSAGES_PER_FOLLOWEE = 5
+PAGE_SIZE = 20
+RUNS = 25
+
+
+def python_list(user_id):
+    followed_users = [follows.user_being_followed_id for follows in db.session.query(Follows).filter(Follows.user_following_id == user_id).all()]
+    return (db.session.query(Message)
+            .filter((Message.user_id.in_(followed_users)) | (Message.user_id == user_id))
+            .order_by(Message.timestamp.desc(), Message.id.desc())
+            .limit(PAGE_SIZE).all())
+
+
+def timeline_for(user_id):
+    return (Message.timeline_for(user_id)
+            .order_by(Message.timestamp.desc(), Message.id.desc())
+            .limit(PAGE_SIZE).all())
+
+
+def materialized(user_id):
+    return (db.session.query(Message)
+            .join(Timeline, Timeline.message_id == Message.id)
+            .filter(Timeline.user_id == user_id)
+            .order_by(Timeline.timestamp.desc(), Timeline.message_id.desc())
+            .limit(PAGE_SIZE).all())
+
+
+def make_reader(count):
+    """Create a reader following `count` users who each have a few messages."""
+
+    conn = db.session.connection()
+    prefix = f"bench{count}_"
+    conn.execute(User.__table__.insert(), [
+        {'username': f"{prefix}{i}", 'email': f"{prefix}{i}@bench.test", 'password': 'x'}
+        for i in range(count + 1)
+    ])
+    ids = [row.id for row in conn.execute(
+        db.select([User.id]).where(User.username.like(f"{prefix}%")).order_by(User.id))]
+    reader, followees = ids[0], ids[1:]
+
+    conn.execute(Follows.__table__.insert(), [
+        {'user_being_followed_id': followee, 'user_following_id': reader} for followee in followees
+    ])
+    now = time.time()
+    conn.execute(Message.__table__.insert(), [
+        {'user_id': followee, 'text': f"message {n}",
+         'timestamp': datetime.fromtimestamp(now - n * len(followees) - i)}
+        for i, followee in enumerate(followees) for n in range(MESSAGES_PER_FOLLOWEE)
+    ])
+    for followee in followees:
+        Timeline.backfill(conn, reader, followee)
+    db.session.commit()
+    return reader, ids
+
+
+def time_query(fn, user_id):
+    samples = []
+    for _ in range(RUNS):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        fn(user_id)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    approaches = [('python-list', python_list), ('timeline_for', timeline_for), ('materialized', materialized)]
+
+    print(f"{'followees':>10} " + " ".join(f"{name:>14}" for name, _ in approaches) + "   (median ms)")
+    with app.app_context():
+        db.create_all()
+        for count in FOLLOWEE_COUNTS:
+            reader, ids = make_reader(count)
+            try:
+                timings = [time_query(fn, reader) for _, fn in approaches]
+                print(f"{count:>10} " + " ".join(f"{ms:>14.2f}" for ms in timings))
+            finally:
+                db.session.rollback()
+                db.session.query(User).filter(User.id.in_(ids)).delete(synchronize_session=False)
+                db.session.commit()
+
+
+if __name__ == '__main__':
+    main()
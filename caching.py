@@ -0,0 +1,227 @@
+"""Small in-process caches shared by the requests a worker serves."""
+
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from jinja2 import nodes, FileSystemBytecodeCache
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+
+class UserSnapshotCache:
+    """Column values of recently seen users, kept for `ttl` seconds.
+
+    Invalidation is version based: invalidate() bumps a user's version, and a
+    snapshot is only stored or served if it was read under the current
+    version. A request that loaded a row just before someone changed it
+    therefore can't put the stale copy back afterwards.
+
+    Each worker has its own cache, so changes made through another worker
+    show up here once the `ttl` runs out.
+    """
+
+    def __init__(self, ttl, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}
+
+    def version(self, user_id):
+        """Current version for `user_id`; read it before loading the row."""
+
+        return self._versions.get(user_id, 0)
+
+    def get(self, user_id):
+        """Cached column values for `user_id`, or None if missing or stale."""
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+
+            expires_at, version, values = entry
+            if expires_at < time.monotonic() or version != self._versions.get(user_id, 0):
+                del self._entries[user_id]
+                return None
+            return values
+
+    def set(self, user_id, values, version):
+        """Store `values` read under `version`, unless the user changed since."""
+
+        if self.ttl <= 0:
+            return
+
+        with self._lock:
+            if version != self._versions.get(user_id, 0):
+                return
+            self._entries.pop(user_id, None)
+            self._entries[user_id] = (time.monotonic() + self.ttl, version, values)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Forget `user_id`'s snapshot and any in-flight reads of it."""
+
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._entries.pop(user_id, None)
+
+
+class TTLCache:
+    """Small LRU mapping whose entries expire after `ttl` seconds."""
+
+    def __init__(self, ttl, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Value stored under `key`, or None if missing or expired."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class FragmentCache:
+    """Rendered template fragments, least recently used dropped first once
+    they add up to more than `max_bytes` characters.
+
+    Each entry is tagged with what it shows (e.g. ('message', 12)), so
+    invalidate(tag) can drop every fragment of it at once.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._size = 0
+
+    def get(self, key):
+        """Fragment stored under `key`, or None."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, tag, value):
+        if len(value) > self.max_bytes:
+            return
+
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (tag, value)
+            self._tags.setdefault(tag, set()).add(key)
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, tag):
+        """Drop every fragment tagged `tag`."""
+
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._discard(key)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        tag, value = entry
+        self._size -= len(value)
+        keys = self._tags[tag]
+        keys.discard(key)
+        if not keys:
+            del self._tags[tag]
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja `{% cache tag, version... %}...{% endcache %}` blocks.
+
+    The block's output is kept in the environment's `fragment_cache` under
+    the template name and the given values, and reused while they stay the
+    same; `tag` is what FragmentCache.invalidate() takes. Anything that
+    differs between viewers belongs outside the block.
+    """
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [nodes.Const(parser.name), parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+
+        return nodes.CallBlock(self.call_method('_render', [nodes.Tuple(key, 'load')]),
+                               [], [], body).set_lineno(lineno)
+
+    def _render(self, key, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = caller()
+            cache.set(key, key[1], fragment)
+        return Markup(fragment)
+
+
+class AtomicBytecodeCache(FileSystemBytecodeCache):
+    """FileSystemBytecodeCache whose files appear all at once, so workers
+    starting together never load one another's half-written templates."""
+
+    def dump_bytecode(self, bucket):
+        fd, path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            bucket.write_bytecode(f)
+        os.replace(path, self._get_cache_filename(bucket))
+
+
+def snapshot(obj, exclude=()):
+    """Plain dict of a mapped object's column values, less those in `exclude`."""
+
+    return {attr.key: getattr(obj, attr.key) for attr in inspect(obj).mapper.column_attrs
+            if attr.key not in exclude}
+
+
+def restore(session, cls, values):
+    """Attach a `cls` built from `values` to `session` without a SELECT.
+
+    Columns missing from `values` are left expired, and load on first use.
+    """
+
+    obj = cls(**values)
+    make_transient_to_detached(obj)
+    return session.merge(obj, load=False)
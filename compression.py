@@ -0,0 +1,105 @@
+"""Response compression.
+
+GzipMiddleware compresses HTML, JSON and other text responses on their way
+out of the WSGI app; WhitespaceCollapse shrinks templates' markup before
+it's rendered, so there's less to send and to compress.
+"""
+
+import re
+import zlib
+
+from jinja2.ext import Extension
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/javascript',
+    'application/json', 'application/javascript', 'image/svg+xml',
+}
+
+
+class GzipMiddleware:
+    """WSGI middleware that gzips text responses for clients that accept it.
+
+    Responses shorter than `minimum_size` bytes, responses of other types
+    and responses that already have a Content-Encoding (e.g. precompressed
+    assets) are passed through untouched. Responses without a
+    Content-Length are assumed to be streamed and are flushed chunk by
+    chunk, so compression doesn't hold back the first bytes.
+    """
+
+    def __init__(self, app, minimum_size=500, level=6, types=COMPRESSIBLE_TYPES):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+        self.types = types
+
+    def __call__(self, environ, start_response):
+        accepts_gzip = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))['gzip'] > 0
+        compress = {}
+
+        def start(status, headers, exc_info=None):
+            headers = Headers(headers)
+            if self._compressible(status, headers):
+                if accepts_gzip and environ['REQUEST_METHOD'] != 'HEAD':
+                    compress['streamed'] = 'Content-Length' not in headers
+                    headers.remove('Content-Length')
+                    headers['Content-Encoding'] = 'gzip'
+                    # the gzipped body is a different byte sequence
+                    etag = headers.get('ETag')
+                    if etag and not etag.startswith('W/'):
+                        headers['ETag'] = 'W/' + etag
+                self._add_vary(headers)
+            return start_response(status, headers.to_wsgi_list(), exc_info)
+
+        # Flask calls start_response before returning its body, so by now
+        # we know whether to compress
+        app_iter = self.app(environ, start)
+        if not compress:
+            return app_iter
+        return self._gzip(app_iter, compress['streamed'])
+
+    def _compressible(self, status, headers):
+        if int(status.split(' ', 1)[0]) in (204, 206, 304) or 'Content-Encoding' in headers:
+            return False
+        if headers.get('Content-Type', '').split(';')[0].strip() not in self.types:
+            return False
+        length = headers.get('Content-Length')
+        return length is None or int(length) >= self.minimum_size
+
+    def _add_vary(self, headers):
+        vary = [value.strip() for value in headers.get('Vary', '').split(',') if value.strip()]
+        if 'accept-encoding' not in (value.lower() for value in vary):
+            headers['Vary'] = ', '.join(vary + ['Accept-Encoding'])
+
+    def _gzip(self, app_iter, streamed):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        try:
+            for chunk in app_iter:
+                data = compressor.compress(chunk)
+                if streamed:
+                    data += compressor.flush(zlib.Z_SYNC_FLUSH)
+                if data:
+                    yield data
+            yield compressor.flush()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+
+class WhitespaceCollapse(Extension):
+    """Jinja extension that drops the indentation from template source.
+
+    Every run of whitespace that contains a line break becomes a single
+    line break, which renders the same in HTML. The contents of <pre> and
+    <textarea> elements, where whitespace shows, are left alone.
+    """
+
+    pattern = re.compile(r'[ \t]*\n\s*')
+    preserved = re.compile(r'(<(?:pre|textarea)\b.*?</(?:pre|textarea)\s*>)', re.IGNORECASE | re.DOTALL)
+
+    def preprocess(self, source, name, filename=None):
+        # split() puts the preserved elements at the odd positions
+        parts = self.preserved.split(source)
+        parts[::2] = [self.pattern.sub('\n', part) for part in parts[::2]]
+        return ''.join(parts)
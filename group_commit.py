@@ -0,0 +1,160 @@
+"""Group commit: coalesce concurrent writes into one transaction.
+
+Each /messages/new request normally commits on its own, and under load
+every one of those commits waits for its own fsync. With group commit on,
+requests hand their row to a background flusher thread instead. The
+flusher collects whatever arrives within a short window, writes it all in
+one transaction, and only then lets the waiting requests answer, so a
+message is never acknowledged before it is durable.
+
+Batches only form from requests running at the same time in one process,
+so group commit needs threaded (gthread) or async (gevent, eventlet)
+workers. Under gunicorn's default sync workers every batch would hold
+one row and each post would just wait out the window; check_workers()
+turns it off there.
+
+Settings (read by init_app):
+
+- GROUP_COMMIT_ENABLED: coalesce writes (default off)
+- GROUP_COMMIT_WINDOW_MS: how long the flusher waits for more rows after
+  the first row of a batch arrives (default 5)
+- GROUP_COMMIT_MAX_BATCH: rows per transaction at most (default 100)
+- GROUP_COMMIT_TIMEOUT: seconds a request waits for its batch to commit
+  before giving up (default 10)
+"""
+
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from queue import Queue, Empty
+
+
+class GroupCommitter:
+    """Flask extension that commits concurrently submitted rows together.
+
+    `write` takes a list of rows, writes and commits them, and returns one
+    result per row; it runs on the flusher thread, inside an app context.
+    """
+
+    def __init__(self, write, app=None):
+        self.write = write
+        self.enabled = False
+        self.window = 0.005
+        self.max_batch = 100
+        self.timeout = 10
+        self._app = None
+        self._queue = None
+        self._queue_pid = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._rows = 0
+        self._failed = 0
+        self._sizes = Counter()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._app = app
+        self.enabled = app.config.setdefault(
+            'GROUP_COMMIT_ENABLED', os.environ.get('GROUP_COMMIT_ENABLED', '0') == '1')
+        self.window = app.config.setdefault(
+            'GROUP_COMMIT_WINDOW_MS', int(os.environ.get('GROUP_COMMIT_WINDOW_MS', 5))) / 1000
+        self.max_batch = app.config.setdefault(
+            'GROUP_COMMIT_MAX_BATCH', int(os.environ.get('GROUP_COMMIT_MAX_BATCH', 100)))
+        self.timeout = app.config.setdefault(
+            'GROUP_COMMIT_TIMEOUT', float(os.environ.get('GROUP_COMMIT_TIMEOUT', 10)))
+
+    def check_workers(self, concurrent):
+        """Turn group commit off, with a warning, unless each process serves
+        requests `concurrent`ly; batches of one only add latency."""
+
+        if self.enabled and not concurrent:
+            self.enabled = False
+            if self._app is not None:
+                self._app.logger.warning("GROUP_COMMIT_ENABLED needs threaded or async workers; "
+                                         "group commit is off in this worker")
+
+    def submit(self, row):
+        """Add `row` to the next batch and wait until that batch commits.
+
+        Returns `write`'s result for the row, or raises its error. Raises
+        concurrent.futures.TimeoutError after `timeout` seconds; the row
+        may still be written later.
+        """
+
+        future = Future()
+        self._flusher().put((row, future))
+        return future.result(timeout=self.timeout)
+
+    def stats(self):
+        """Batch counts and sizes for monitoring."""
+
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'window_ms': round(self.window * 1000, 2),
+                'max_batch': self.max_batch,
+                'batches': self._batches,
+                'rows': self._rows,
+                'failed_batches': self._failed,
+                'avg_batch_size': round(self._rows / self._batches, 2) if self._batches else 0.0,
+                'max_batch_size': max(self._sizes) if self._sizes else 0,
+                'batch_sizes': {str(size): n for size, n in sorted(self._sizes.items())},
+            }
+
+    def _flusher(self):
+        # a thread doesn't survive a fork (e.g. gunicorn preload), so each
+        # process starts its own flusher on first use, and a new one if it
+        # died; rows left on a dead flusher's queue time out
+        with self._lock:
+            if self._queue is None or self._queue_pid != os.getpid() or not self._thread.is_alive():
+                self._queue = Queue()
+                self._queue_pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, args=(self._queue,), name='group-commit',
+                                                daemon=True)
+                self._thread.start()
+            return self._queue
+
+    def _run(self, queue):
+        while True:
+            batch = [queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(queue.get(timeout=remaining))
+                except Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            if self._app is not None:
+                with self._app.app_context():
+                    results = self.write([row for row, _ in batch])
+            else:
+                results = self.write([row for row, _ in batch])
+        except Exception as error:
+            with self._lock:
+                self._failed += 1
+            if len(batch) == 1:
+                batch[0][1].set_exception(error)
+            else:
+                # one bad row shouldn't fail its neighbours: retry each alone
+                for item in batch:
+                    self._flush([item])
+            return
+
+        with self._lock:
+            self._batches += 1
+            self._rows += len(batch)
+            self._sizes[len(batch)] += 1
+
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
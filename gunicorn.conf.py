@@ -0,0 +1,12 @@
+"""gunicorn settings, read from the working directory by `gunicorn app:app`."""
+
+
+def post_worker_init(worker):
+    """Warm each worker up once it has loaded the app, before its first request."""
+
+    from gunicorn.workers.sync import SyncWorker
+
+    from app import start_worker
+    # sync workers serve one request at a time; gthread, gevent and
+    # eventlet workers serve several
+    start_worker(concurrent=not isinstance(worker, SyncWorker))
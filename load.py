@@ -0,0 +1,173 @@
+"""Bulk-load the generator/*.csv fixtures with COPY.
+
+Each CSV is streamed into Postgres with COPY FROM STDIN, COPY_CHUNK_SIZE
+bytes at a time, so memory use doesn't grow with the file. Users go first,
+since messages and follows refer to them by id; messages and follows are
+then loaded side by side on their own connections. Secondary indexes are
+dropped before loading and rebuilt once at the end, which is much cheaper
+than updating them row by row. Then the sequences are set past the loaded
+ids, and the timelines and counters that the model listeners would have
+maintained are rebuilt.
+
+The CSVs have no id column, and messages.csv and follows.csv refer to
+users by their line number in users.csv. So the tables are emptied first
+and their ids restarted, which keeps those references correct.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from models import db, User, Message, Follows, Likes, LikeCountShard, Timeline
+
+COPY_CHUNK_SIZE = 1024 * 1024
+MAINTENANCE_WORK_MEM = '1GB'
+
+# loaded in order; tables in the same group are loaded in parallel
+FIXTURES = [
+    [(User.__table__, 'users.csv')],
+    [(Message.__table__, 'messages.csv'), (Follows.__table__, 'follows.csv')],
+]
+EMPTIED = [User.__table__, Message.__table__, Follows.__table__, Likes.__table__,
+           LikeCountShard.__table__, Timeline.__table__]
+REINDEXED = [User.__table__, Message.__table__, Follows.__table__, Timeline.__table__]
+
+
+def csv_columns(table, path):
+    """The columns named in the header of the CSV at `path`, checked
+    against `table`."""
+
+    with open(path, newline='') as f:
+        columns = f.readline().strip().split(',')
+    unknown = set(columns) - set(table.c.keys())
+    if unknown:
+        raise ValueError(f"{path} has columns {table.name} doesn't: {', '.join(sorted(unknown))}")
+    return columns
+
+
+def copy_csv(engine, table, path):
+    """Stream the CSV at `path` into `table`; return the number of rows."""
+
+    columns = csv_columns(table, path)
+    with open(path, newline='') as f:
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.copy_expert(
+                f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, HEADER true)",
+                f, size=COPY_CHUNK_SIZE)
+            rows = cursor.rowcount
+            if rows < 0:
+                # the table was emptied first, so everything in it is new
+                cursor.execute(f"SELECT count(*) FROM {table.name}")
+                rows = cursor.fetchone()[0]
+            connection.commit()
+        finally:
+            connection.close()
+
+    return rows
+
+
+def timed(fn, *args):
+    """Run fn(*args); return its result and the seconds it took."""
+
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def reset_sequence(connection, table):
+    """Point `table`'s id sequence just past its largest id."""
+
+    connection.execute(db.text(
+        f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+        f"COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {table.name}"))
+
+
+def create_index(engine, index):
+    with engine.connect() as connection:
+        connection.execute(db.text(f"SET maintenance_work_mem = '{MAINTENANCE_WORK_MEM}'"))
+        index.create(connection)
+
+
+def build_indexes(pool, engine, indexes, report):
+    """Create `indexes` in parallel on `pool`; report any that fail rather
+    than raise, and return their names."""
+
+    start = time.perf_counter()
+    failed = []
+    for index, job in [(index, pool.submit(create_index, engine, index)) for index in indexes]:
+        try:
+            job.result()
+        except Exception as error:
+            failed.append(index.name)
+            report(f"building index {index.name} failed: {error}")
+    report(f"{len(indexes) - len(failed)} indexes built in {time.perf_counter() - start:.1f}s")
+    return failed
+
+
+def load(engine, directory='generator', workers=2, report=print):
+    """Empty the fixture tables and load them from the CSVs in `directory`.
+
+    `report` is called with a line of progress after each step; returns
+    the total number of rows loaded.
+    """
+
+    started = time.perf_counter()
+    indexes = [index for table in REINDEXED for index in table.indexes]
+
+    # a bad CSV should fail the load before anything is emptied or dropped
+    for group in FIXTURES:
+        for table, filename in group:
+            csv_columns(table, os.path.join(directory, filename))
+
+    with engine.begin() as connection:
+        connection.execute(db.text(
+            f"TRUNCATE {', '.join(table.name for table in EMPTIED)} RESTART IDENTITY CASCADE"))
+        for index in indexes:
+            connection.execute(db.text(f"DROP INDEX IF EXISTS {index.name}"))
+
+    total = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for group in FIXTURES:
+                jobs = [(table, pool.submit(timed, copy_csv, engine, table, os.path.join(directory, filename)))
+                        for table, filename in group]
+                for table, job in jobs:
+                    rows, seconds = job.result()
+                    total += rows
+                    report(f"{table.name}: {rows} rows in {seconds:.1f}s ({rows / max(seconds, 1e-6):,.0f} rows/s)")
+
+            with engine.begin() as connection:
+                for table in (User.__table__, Message.__table__):
+                    reset_sequence(connection, table)
+
+            # bulk loads skip the model listeners, so build the timelines in
+            # one pass, before their indexes exist
+            _, seconds = timed(rebuild_timelines, engine)
+            report(f"timelines rebuilt in {seconds:.1f}s")
+
+        except BaseException:
+            # even a failed load mustn't leave the tables without their
+            # indexes; the load's own error is the one to raise
+            build_indexes(pool, engine, indexes, report)
+            raise
+
+        failed = build_indexes(pool, engine, indexes, report)
+        if failed:
+            raise RuntimeError(f"could not build indexes: {', '.join(failed)}")
+
+    # the counters count by user id, which wants the indexes in place
+    with engine.begin() as connection:
+        _, seconds = timed(User.reconcile_counters, connection)
+        report(f"counters rebuilt in {seconds:.1f}s")
+        connection.execute(db.text(f"ANALYZE {', '.join(table.name for table in REINDEXED)}"))
+
+    seconds = time.perf_counter() - started
+    report(f"loaded {total} rows in {seconds:.1f}s ({total / max(seconds, 1e-6):,.0f} rows/s overall)")
+    return total
+
+
+def rebuild_timelines(engine):
+    with engine.begin() as connection:
+        Timeline.rebuild(connection)
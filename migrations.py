@@ -0,0 +1,128 @@
+"""Versioned schema migrations for Warbler.
+
+db.create_all() only creates tables that are missing; it never adds columns
+or indexes to tables that already exist. Each migration below runs once, in
+order, inside its own transaction, and is recorded in schema_migrations:
+
+    flask migrate          # apply pending migrations
+    flask check-indexes    # list indexes the models declare but the db lacks
+
+A brand new database is built straight from the models with create_all and
+every migration is marked as applied.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import Table, MetaData, Column, Integer, Text, DateTime, select
+
+from models import db, User, Message, LikeCountShard, Timeline
+
+schema_migrations = Table(
+    'schema_migrations',
+    MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('description', Text, nullable=False),
+    Column('applied_at', DateTime, nullable=False, default=datetime.now),
+)
+
+
+def create_timelines(connection):
+    Timeline.__table__.create(connection, checkfirst=True)
+    Timeline.rebuild(connection)
+
+
+def create_like_count_shards(connection):
+    LikeCountShard.__table__.create(connection, checkfirst=True)
+
+
+# (version, description, steps); a step is SQL or a callable taking the connection
+MIGRATIONS = [
+    (1, "materialized home timelines", [
+        create_timelines,
+    ]),
+    (2, "user counter columns", [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS messages_count INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS following_count INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS followers_count INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS likes_count INTEGER NOT NULL DEFAULT 0",
+        User.reconcile_counters,
+    ]),
+    (3, "indexes for feed, follow and like lookups", [
+        "CREATE INDEX IF NOT EXISTS ix_messages_user_id_timestamp ON messages (user_id, timestamp DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_follows_user_following_id ON follows (user_following_id, user_being_followed_id)",
+        "CREATE INDEX IF NOT EXISTS ix_likes_user_id_message_id ON likes (user_id, message_id)",
+    ]),
+    (4, "trigram index for username search", [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_users_username_trgm ON users USING gin (username gin_trgm_ops)",
+    ]),
+    (5, "likes keyed on (user_id, message_id)", [
+        "DROP INDEX IF EXISTS ix_likes_user_id_message_id",
+        "ALTER TABLE likes DROP CONSTRAINT IF EXISTS likes_message_id_key",
+        "ALTER TABLE likes DROP CONSTRAINT IF EXISTS likes_pkey",
+        "ALTER TABLE likes DROP COLUMN IF EXISTS id",
+        "DELETE FROM likes WHERE user_id IS NULL OR message_id IS NULL",
+        "ALTER TABLE likes ADD PRIMARY KEY (user_id, message_id)",
+    ]),
+    (6, "per-message like counts", [
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS like_count INTEGER NOT NULL DEFAULT 0",
+        create_like_count_shards,
+        Message.reconcile_like_counts,
+    ]),
+    (7, "user profile versions", [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS profile_version INTEGER NOT NULL DEFAULT 0",
+    ]),
+]
+
+
+def applied_versions(connection):
+    """Versions already recorded in schema_migrations."""
+
+    schema_migrations.create(connection, checkfirst=True)
+    return {version for (version,) in connection.execute(select([schema_migrations.c.version]))}
+
+
+def pending_migrations(connection):
+    """Migrations not yet applied to this database, in order."""
+
+    applied = applied_versions(connection)
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+
+def upgrade(connection):
+    """Apply pending migrations; return the (version, description) pairs applied."""
+
+    if not connection.dialect.has_table(connection, User.__tablename__):
+        with connection.begin():
+            db.metadata.create_all(connection)
+            applied_versions(connection)
+            connection.execute(schema_migrations.insert(), [
+                {'version': version, 'description': description} for version, description, _ in MIGRATIONS
+            ])
+        return []
+
+    applied = []
+    for version, description, steps in pending_migrations(connection):
+        with connection.begin():
+            for step in steps:
+                if callable(step):
+                    step(connection)
+                else:
+                    connection.execute(step)
+            connection.execute(schema_migrations.insert(), {'version': version, 'description': description})
+        applied.append((version, description))
+    return applied
+
+
+def missing_indexes(connection):
+    """(table, index) pairs declared on the models but absent from the database."""
+
+    existing = {name for (name,) in connection.execute(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()")}
+
+    return sorted(
+        (table.name, index.name)
+        for table in db.metadata.sorted_tables
+        for index in table.indexes
+        if index.name not in existing
+    )
@@ -1,13 +1,23 @@
 """SQLAlchemy models for Warbler."""
 
+import random
+from collections import Counter
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm.attributes import get_history, PASSIVE_NO_INITIALIZE
 
-bcrypt = Bcrypt()
+from passwords import PasswordHasher
+
+passwords = PasswordHasher()
 db = SQLAlchemy()
 
+# once a message has this many likes, new likes are counted in shard rows
+HOT_MESSAGE_LIKES = 100
+LIKE_COUNT_SHARDS = 8
+
 
 class Follows(db.Model):
     """Connection of a follower <-> followed_user."""
@@ -26,28 +36,82 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # the primary key leads with user_being_followed_id, so "who does this
+    # user follow" needs its own index
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id', user_following_id, user_being_followed_id),
+    )
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
 
     __tablename__ = 'likes' 
 
-    id = db.Column(
-        db.Integer,
-        primary_key=True
-    )
-
+    # one row per (user, message); the primary key also serves lookups
+    # of a user's likes
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete='cascade')
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
     )
 
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        primary_key=True,
     )
 
+    @classmethod
+    def add(cls, user_id, message_id):
+        """Like a message; return True if a new like was recorded.
+
+        A single INSERT ... ON CONFLICT DO NOTHING, which also refuses likes
+        of the user's own (or a missing) message, so the cost doesn't depend
+        on how many likes the user already has.
+        """
+
+        message = db.select([db.literal(user_id), Message.id]).where(
+            Message.id == message_id).where(Message.user_id != user_id)
+
+        added = db.session.execute(
+            pg_insert(cls.__table__)
+            .from_select(['user_id', 'message_id'], message)
+            .on_conflict_do_nothing()
+            .returning(cls.message_id)
+        ).first()
+
+        if added:
+            User.adjust_counters(db.session.connection(), [user_id], likes_count=1)
+            Message.adjust_like_count(db.session.connection(), message_id, 1)
+        return added is not None
+
+    @classmethod
+    def remove(cls, user_id, message_id):
+        """Unlike a message; return True if there was a like to remove."""
+
+        removed = db.session.execute(
+            cls.__table__.delete()
+            .where(cls.user_id == user_id)
+            .where(cls.message_id == message_id)
+            .returning(cls.message_id)
+        ).first()
+
+        if removed:
+            User.adjust_counters(db.session.connection(), [user_id], likes_count=-1)
+            Message.adjust_like_count(db.session.connection(), message_id, -1)
+        return removed is not None
+
+    @classmethod
+    def liked_ids(cls, user_id, message_ids):
+        """Return the set of `message_ids` that `user_id` has liked, in one query."""
+
+        if not message_ids:
+            return set()
+
+        rows = db.session.query(cls.message_id).filter(cls.user_id == user_id, cls.message_id.in_(message_ids))
+        return {message_id for (message_id,) in rows}
+
 
 class User(db.Model):
     """User in the system."""
@@ -94,8 +158,55 @@ class User(db.Model):
         nullable=False,
     )
 
+    # denormalized counts so profile headers don't load whole collections;
+    # kept in step by the listeners at the bottom of this module and
+    # recomputed from scratch by `flask reconcile-counters`
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # bumped whenever the name or picture shown beside the user's messages
+    # changes; part of the cache key of rendered messages
+    profile_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     messages = db.relationship('Message', cascade="all, delete")
 
+    # trigram index so `/users?q=` substring searches don't scan the table
+    __table_args__ = (
+        db.Index('ix_users_username_trgm', 'username', postgresql_using='gin',
+                 postgresql_ops={'username': 'gin_trgm_ops'}),
+    )
+
     followers = db.relationship(
         "User",
         secondary="follows",
@@ -124,14 +235,69 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return db.session.query(
+            db.exists()
+            .where(Follows.user_being_followed_id == self.id)
+            .where(Follows.user_following_id == other_user.id)
+        ).scalar()
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return db.session.query(
+            db.exists()
+            .where(Follows.user_following_id == self.id)
+            .where(Follows.user_being_followed_id == other_user.id)
+        ).scalar()
+
+    def following_ids(self, user_ids):
+        """Return the set of `user_ids` this user follows, in one query.
+
+        Lets list pages decide every card's Follow/Unfollow button at once
+        instead of calling is_following per card.
+        """
+
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+
+        rows = db.session.query(Follows.user_being_followed_id).filter(
+            Follows.user_following_id == self.id,
+            Follows.user_being_followed_id.in_(user_ids),
+        )
+        return {user_id for (user_id,) in rows}
+
+    @classmethod
+    def adjust_counters(cls, connection, user_ids, **deltas):
+        """Add `deltas` (e.g. likes_count=-1) to the counters of `user_ids`.
+
+        `user_ids` may be a list or a select of ids.
+        """
+
+        if isinstance(user_ids, (list, set, tuple)) and not user_ids:
+            return
+
+        connection.execute(
+            cls.__table__.update()
+            .where(cls.id.in_(user_ids))
+            .values({getattr(cls, name): getattr(cls, name) + delta for name, delta in deltas.items()})
+        )
+
+    @classmethod
+    def reconcile_counters(cls, connection):
+        """Recompute every user's counters from the underlying tables."""
+
+        def count(key):
+            return db.select([db.func.count()]).where(key == cls.id).as_scalar()
+
+        connection.execute(
+            cls.__table__.update().values(
+                messages_count=count(Message.user_id),
+                following_count=count(Follows.user_following_id),
+                followers_count=count(Follows.user_being_followed_id),
+                likes_count=count(Likes.user_id),
+            )
+        )
 
     @classmethod
     def signup(cls, username, email, password, image_url, header_image_url, bio, location):
@@ -140,7 +306,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = passwords.hash(password)
 
         user = User(
             username=username,
@@ -164,13 +330,18 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash was made at a different bcrypt cost than the
+        configured one, it is replaced with a fresh hash; the caller commits.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = passwords.check(user.password, password)
             if is_auth:
+                if passwords.needs_rehash(user.password):
+                    user.password = passwords.hash(password)
                 return user
 
         return False
@@ -204,8 +375,342 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # likes counted on the row itself; hot messages also have shard rows
+    # in like_count_shards that are added in when reading (see like_counts)
+    like_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     user = db.relationship('User')
 
+    __table_args__ = (
+        db.Index('ix_messages_user_id_timestamp', user_id, timestamp.desc(), id.desc()),
+    )
+
+    @classmethod
+    def insert_many(cls, connection, rows):
+        """Insert messages from `rows` (dicts with text and user_id) in one
+        statement and return their ids, in the order given.
+
+        Like a bulk insert, this skips the model listeners, so the timelines
+        and authors' message counts are updated here, once for the batch.
+        """
+
+        if not rows:
+            return []
+
+        ids = [id for id, in connection.execute(
+            pg_insert(cls.__table__).values(rows).returning(cls.id)
+        )]
+
+        Timeline.fan_out(connection, ids)
+        per_user = Counter(row['user_id'] for row in rows)
+        for n in set(per_user.values()):
+            User.adjust_counters(connection, [u for u, c in per_user.items() if c == n], messages_count=n)
+
+        return ids
+
+    @classmethod
+    def adjust_like_count(cls, connection, message_id, delta):
+        """Add `delta` to a message's like count.
+
+        Until a message reaches HOT_MESSAGE_LIKES the count is updated on its
+        own row. After that, changes go to one of LIKE_COUNT_SHARDS rows
+        chosen at random, so concurrent likes of a viral message don't all
+        queue on one row lock.
+        """
+
+        updated = connection.execute(
+            cls.__table__.update()
+            .where(cls.id == message_id)
+            .where(cls.like_count < HOT_MESSAGE_LIKES)
+            .values(like_count=cls.like_count + delta)
+        ).rowcount
+
+        if not updated:
+            shards = LikeCountShard.__table__
+            connection.execute(
+                pg_insert(shards)
+                .values(message_id=message_id, shard=random.randrange(LIKE_COUNT_SHARDS), count=delta)
+                .on_conflict_do_update(
+                    index_elements=[shards.c.message_id, shards.c.shard],
+                    set_={'count': shards.c.count + delta},
+                )
+            )
+
+    @classmethod
+    def like_counts(cls, message_ids):
+        """Map each of `message_ids` to its like count, in one query."""
+
+        if not message_ids:
+            return {}
+
+        rows = (db.session.query(cls.id, cls.like_count + db.func.coalesce(db.func.sum(LikeCountShard.count), 0))
+                .outerjoin(LikeCountShard, LikeCountShard.message_id == cls.id)
+                .filter(cls.id.in_(message_ids))
+                .group_by(cls.id))
+        return dict(rows)
+
+    @classmethod
+    def fold_like_counts(cls, connection):
+        """Move the shard rows' totals onto messages.like_count.
+
+        The shards are deleted and added in one statement, so likes counted
+        while this runs are not lost.
+        """
+
+        connection.execute(db.text("""
+            WITH moved AS (
+                DELETE FROM like_count_shards RETURNING message_id, count
+            )
+            UPDATE messages SET like_count = messages.like_count + totals.count
+            FROM (SELECT message_id, SUM(count) AS count FROM moved GROUP BY message_id) AS totals
+            WHERE messages.id = totals.message_id
+        """))
+
+    @classmethod
+    def reconcile_like_counts(cls, connection):
+        """Recompute every message's like count from the likes table."""
+
+        connection.execute(LikeCountShard.__table__.delete())
+        connection.execute(
+            cls.__table__.update().values(
+                like_count=db.select([db.func.count()]).where(Likes.message_id == cls.id).as_scalar()
+            )
+        )
+
+    @classmethod
+    def timeline_for(cls, user_id):
+        """Query for the messages in `user_id`'s home feed.
+
+        The followed ids are resolved server-side as a subquery, so the feed
+        is one statement (a semi-join Postgres can drive off an index on
+        messages.user_id) instead of a Python list sent back as an IN literal.
+        Callers add their own ordering and limit.
+        """
+
+        authors = db.union_all(
+            db.select([Follows.user_being_followed_id]).where(Follows.user_following_id == user_id),
+            db.select([db.literal(user_id)]),
+        )
+        return db.session.query(cls).filter(cls.user_id.in_(authors))
+
+
+class LikeCountShard(db.Model):
+    """Part of a hot message's like count; see Message.adjust_like_count."""
+
+    __tablename__ = 'like_count_shards'
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    shard = db.Column(
+        db.SmallInteger,
+        primary_key=True,
+    )
+
+    count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+
+class Timeline(db.Model):
+    """Materialized home feed: one row per message in a user's timeline.
+
+    Rows are written when messages are posted and when follows change (see
+    the listeners below), so the home page is a single indexed range read
+    instead of a query over everyone the user follows.
+    """
+
+    __tablename__ = 'timelines'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timelines_user_id_timestamp', user_id, timestamp.desc(), message_id.desc()),
+        db.Index('ix_timelines_user_id_author_id', user_id, author_id),
+    )
+
+    @classmethod
+    def fan_out(cls, connection, message_ids):
+        """Add messages to their authors' and their authors' followers' timelines."""
+
+        followers = db.select(
+            [Follows.user_following_id, Message.id, Message.user_id, Message.timestamp]
+        ).select_from(
+            db.join(Message.__table__, Follows.__table__, Follows.user_being_followed_id == Message.user_id)
+        ).where(Message.id.in_(message_ids))
+
+        authors = db.select(
+            [Message.user_id.label('user_id'), Message.id, Message.user_id.label('author_id'), Message.timestamp]
+        ).where(Message.id.in_(message_ids))
+
+        connection.execute(
+            pg_insert(cls.__table__)
+            .from_select(['user_id', 'message_id', 'author_id', 'timestamp'], db.union_all(followers, authors))
+            .on_conflict_do_nothing()
+        )
+
+    @classmethod
+    def backfill(cls, connection, user_id, followed_id):
+        """Copy `followed_id`'s messages into `user_id`'s timeline after a follow."""
+
+        messages = db.select(
+            [db.literal(user_id), Message.id, Message.user_id, Message.timestamp]
+        ).where(Message.user_id == followed_id)
+
+        connection.execute(
+            pg_insert(cls.__table__)
+            .from_select(['user_id', 'message_id', 'author_id', 'timestamp'], messages)
+            .on_conflict_do_nothing()
+        )
+
+    @classmethod
+    def prune(cls, connection, user_id, followed_id):
+        """Remove `followed_id`'s messages from `user_id`'s timeline after an unfollow."""
+
+        connection.execute(
+            cls.__table__.delete()
+            .where(cls.user_id == user_id)
+            .where(cls.author_id == followed_id)
+        )
+
+    @classmethod
+    def rebuild(cls, connection):
+        """Recompute every timeline from the messages and follows tables.
+
+        Needed after loading data with bulk inserts, which skip the listeners.
+        """
+
+        connection.execute(cls.__table__.delete())
+        all_ids = db.select([Message.id])
+        cls.fan_out(connection, all_ids)
+
+
+event.listen(User.__table__, 'before_create', db.DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+
+##############################################################################
+# Keeping the materialized timelines and counters in step with the
+# messages, follows and likes tables
+
+
+@event.listens_for(Message, 'after_insert')
+def add_message_to_timelines(mapper, connection, message):
+    """Fan a newly posted message out to its followers' timelines."""
+
+    Timeline.fan_out(connection, [message.id])
+    User.adjust_counters(connection, [message.user_id], messages_count=1)
+
+
+@event.listens_for(Likes, 'after_insert')
+def count_added_like(mapper, connection, like):
+    User.adjust_counters(connection, [like.user_id], likes_count=1)
+    Message.adjust_like_count(connection, like.message_id, 1)
+
+
+@event.listens_for(Likes, 'after_delete')
+def count_removed_like(mapper, connection, like):
+    User.adjust_counters(connection, [like.user_id], likes_count=-1)
+    Message.adjust_like_count(connection, like.message_id, -1)
+
+
+@event.listens_for(db.session, 'before_flush')
+def count_cascaded_deletes(session, flush_context, instances):
+    """Adjust counters for rows that foreign-key cascades are about to remove.
+
+    This runs before the flush, while the likes and follows rows the
+    cascades will delete can still be found.
+    """
+
+    connection = session.connection()
+    for obj in session.deleted:
+        if isinstance(obj, Message):
+            User.adjust_counters(connection, [obj.user_id], messages_count=-1)
+            likers = db.select([Likes.user_id]).where(Likes.message_id == obj.id)
+            User.adjust_counters(connection, likers, likes_count=-1)
+
+        elif isinstance(obj, User):
+            followed = db.select([Follows.user_being_followed_id]).where(Follows.user_following_id == obj.id)
+            User.adjust_counters(connection, followed, followers_count=-1)
+            followers = db.select([Follows.user_following_id]).where(Follows.user_being_followed_id == obj.id)
+            User.adjust_counters(connection, followers, following_count=-1)
+            # any message's base count can absorb the change, hot or not
+            liked = db.select([Likes.message_id]).where(Likes.user_id == obj.id)
+            connection.execute(
+                Message.__table__.update()
+                .where(Message.id.in_(liked))
+                .values(like_count=Message.like_count - 1)
+            )
+
+
+@event.listens_for(db.session, 'after_flush')
+def sync_with_collections(session, flush_context):
+    """Update timelines and counters for follows and likes changed in this flush."""
+
+    connection = session.connection()
+    for user in list(session.new) + list(session.dirty):
+        if not isinstance(user, User):
+            continue
+
+        following = get_history(user, 'following', passive=PASSIVE_NO_INITIALIZE)
+        for followed in following.added:
+            Timeline.backfill(connection, user.id, followed.id)
+            User.adjust_counters(connection, [user.id], following_count=1)
+            User.adjust_counters(connection, [followed.id], followers_count=1)
+        for followed in following.deleted:
+            Timeline.prune(connection, user.id, followed.id)
+            User.adjust_counters(connection, [user.id], following_count=-1)
+            User.adjust_counters(connection, [followed.id], followers_count=-1)
+
+        followers = get_history(user, 'followers', passive=PASSIVE_NO_INITIALIZE)
+        for follower in followers.added:
+            Timeline.backfill(connection, follower.id, user.id)
+            User.adjust_counters(connection, [user.id], followers_count=1)
+            User.adjust_counters(connection, [follower.id], following_count=1)
+        for follower in followers.deleted:
+            Timeline.prune(connection, follower.id, user.id)
+            User.adjust_counters(connection, [user.id], followers_count=-1)
+            User.adjust_counters(connection, [follower.id], following_count=-1)
+
+        likes = get_history(user, 'likes', passive=PASSIVE_NO_INITIALIZE)
+        delta = len(likes.added) - len(likes.deleted)
+        if delta:
+            User.adjust_counters(connection, [user.id], likes_count=delta)
+        for message in likes.added:
+            Message.adjust_like_count(connection, message.id, 1)
+        for message in likes.deleted:
+            Message.adjust_like_count(connection, message.id, -1)
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -215,3 +720,4 @@ def connect_db(app):
 
     db.app = app
     db.init_app(app)
+    passwords.init_app(app)
@@ -0,0 +1,144 @@
+"""Password hashing and checking in a bounded pool of worker processes.
+
+bcrypt is deliberately slow. Run inline, every signup, login and profile
+edit holds a request thread for the whole hash. PasswordHasher sends that
+work to a small process pool and caps how many jobs may be admitted; past
+that, callers get PasswordQueueFull (which the app answers with a 503)
+rather than piling up.
+
+The pool, and the cap, are per app process: with N gunicorn workers there
+are N pools of BCRYPT_POOL_SIZE processes, so size it for the host, not
+the worker. The calling request still waits for its hash. Only under
+threaded or gevent workers does that leave the worker free to serve
+other requests meanwhile; under the default sync workers the pool just
+bounds the CPU bcrypt may use, and the cap is what keeps a login burst
+from holding every worker.
+
+Settings (read by init_app):
+
+- BCRYPT_LOG_ROUNDS: bcrypt cost for new hashes (default 12); hashes made
+  at another cost are upgraded the next time their owner logs in
+- BCRYPT_POOL_SIZE: worker processes per app process; 0 hashes inline
+- BCRYPT_MAX_QUEUE: jobs allowed to wait for a free pool process before
+  further callers are refused
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+
+def hash_password(password, rounds):
+    """bcrypt-hash `password` at cost `rounds` (runs in a pool process)."""
+
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def check_password(hashed, password):
+    """Does `password` match `hashed`? (runs in a pool process)"""
+
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+class PasswordQueueFull(Exception):
+    """Raised instead of queueing a hash when the pool is saturated."""
+
+
+class PasswordHasher:
+    """Flask extension that runs bcrypt in a bounded process pool."""
+
+    def __init__(self, app=None):
+        self.rounds = 12
+        self.pool_size = 0
+        self.max_queue = 32
+        self._executor = None
+        self._executor_pid = None
+        self._slots = threading.BoundedSemaphore(self.max_queue)
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._total_ms = 0.0
+        self._max_ms = 0.0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.rounds = app.config.setdefault('BCRYPT_LOG_ROUNDS', int(os.environ.get('BCRYPT_LOG_ROUNDS', 12)))
+        self.pool_size = app.config.setdefault('BCRYPT_POOL_SIZE', int(os.environ.get('BCRYPT_POOL_SIZE', 2)))
+        self.max_queue = app.config.setdefault('BCRYPT_MAX_QUEUE', int(os.environ.get('BCRYPT_MAX_QUEUE', 32)))
+        self._slots = threading.BoundedSemaphore(self.pool_size + self.max_queue)
+
+    def hash(self, password):
+        """Hash `password` at the configured cost."""
+
+        return self._run(hash_password, password, self.rounds)
+
+    def check(self, hashed, password):
+        """Does `password` match `hashed`?"""
+
+        return self._run(check_password, hashed, password)
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made at a different cost than the configured one?"""
+
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def stats(self):
+        """Queue depth and latency figures for monitoring."""
+
+        with self._lock:
+            in_flight = min(self._admitted, self.pool_size) if self.pool_size > 0 else self._admitted
+            return {
+                'pool_size': self.pool_size,
+                'rounds': self.rounds,
+                'waiting': self._admitted - in_flight,
+                'in_flight': in_flight,
+                'rejected': self._rejected,
+                'completed': self._completed,
+                'avg_latency_ms': round(self._total_ms / self._completed, 2) if self._completed else 0.0,
+                'max_latency_ms': round(self._max_ms, 2),
+            }
+
+    def _pool(self):
+        # a pool inherited across fork (e.g. gunicorn preload) can't be
+        # used by the child, so each process makes its own
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.pool_size)
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run(self, fn, *args):
+        # refuse rather than block: a caller that waited for a slot would
+        # hold its worker all the same
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise PasswordQueueFull(f"{self.pool_size + self.max_queue} password jobs already admitted")
+
+        start = time.perf_counter()
+        with self._lock:
+            self._admitted += 1
+        try:
+            if self.pool_size > 0:
+                result = self._pool().submit(fn, *args).result()
+            else:
+                result = fn(*args)
+        finally:
+            self._slots.release()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self._admitted -= 1
+                self._completed += 1
+                self._total_ms += elapsed_ms
+                self._max_ms = max(self._max_ms, elapsed_ms)
+
+        return result
@@ -1,20 +1,12 @@
 """Seed database with sample data from CSV Files."""
 
-from csv import DictReader
 from app import db
-from models import User, Message, Follows
+import load
+import migrations
 
 
-db.drop_all()
-db.create_all()
+# make sure the schema is current, then replace the data in it
+with db.engine.connect() as connection:
+    migrations.upgrade(connection)
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
-
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
-
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
-
-db.session.commit()
+load.load(db.engine)
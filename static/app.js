@@ -1,5 +1,3 @@
-const $likesButton = $('#likes-button');
-const $thumbsUpIcon = $('.fa-thumbs-up');
 const $messageArea = $('.message-area');
 const $alertSpace = $('#alert-space');
 const $userLink = $('#current-user-link');
@@ -10,55 +8,36 @@ const $dismissModal = $('#dismiss-modal');
 const $closeButton = $('.btn-close');
 const $modalBody = $('.modal-body');
 const $container = $('.container');
+const $search = $('#search');
+const $usernameSuggestions = $('#username-suggestions');
 
-//event listener for clicking like/unlike button
-$likesButton.on('click', async function(event){
+// event listener for clicking like/unlike buttons; delegated from the list
+// so a click on the thumbs-up icon is handled once, by its button
+$('#messages').on('click', '.likes-button', async function(event){
     event.preventDefault();
-    console.log('like button clicked');
-    console.log('msg_id should be:');
-    console.log($(event.currentTarget).closest('li').attr('id'));
-    const msg_id = $(event.currentTarget).closest('li').attr('id');
-    const new_like = new Like(msg_id)
-    let response = await new_like.addremoveLike();
-    console.log('response = ', response);
-    if (response == 'like added'){
-        console.log('like added if')
-        $(event.currentTarget).removeClass('btn-secondary')
-        $(event.currentTarget).addClass('btn-primary');
-        console.log($(event.currentTarget).attr('class'))
+    const $button = $(event.currentTarget);
+    if ($button.data('pending')){
+        return;
     }
-    else if (response == 'like removed'){
-        console.log('like removed if')
-        $(event.currentTarget).removeClass('btn-primary')
-        $(event.currentTarget).addClass('btn-secondary');
-    }
-    else if (response == 'request failed'){
-        $alertSpace.text("Request failed. Please try again");
-    }
-})
-
-//event listener for clicking thumbs up icon
-$thumbsUpIcon.on('click', async function(event){
-    event.preventDefault();
-    console.log('thums up icon clicked');
-    console.log('msg_id should be:');
-    console.log($(event.currentTarget).closest('li').attr('id'));
-    const msg_id = $(event.currentTarget).closest('li').attr('id');
-    const new_like = new Like(msg_id)
-    let response = await new_like.addremoveLike();
-    console.log('response = ', response);
+    $button.data('pending', true);
+    const msg_id = $button.closest('li').attr('id');
+    const liked = !$button.hasClass('btn-primary');
+    const response = await new Like(msg_id).addremoveLike(liked);
+    $button.data('pending', false);
+    const $count = $button.find('.like-count');
     if (response === 'like added'){
-        console.log('like added if')
-        console.log(event.currentTarget.parentNode)
-        $(event.currentTarget.parentNode).removeClass('btn-secondary')
-        $(event.currentTarget.parentNode).addClass('btn-primary');
-        console.log($(event.currentTarget).attr('class'))
+        if ($button.hasClass('btn-secondary')){
+            $count.text(Number($count.text()) + 1);
+        }
+        $button.removeClass('btn-secondary');
+        $button.addClass('btn-primary');
     }
     else if (response === 'like removed'){
-        console.log('like removed if')
-        console.log(event.currentTarget.parentNode)
-        $(event.currentTarget.parentNode).removeClass('btn-primary')
-        $(event.currentTarget.parentNode).addClass('btn-secondary');
+        if ($button.hasClass('btn-primary')){
+            $count.text(Number($count.text()) - 1);
+        }
+        $button.removeClass('btn-primary');
+        $button.addClass('btn-secondary');
     }
     else if (response === 'request failed'){
         $alertSpace.text("Request failed. Please try again");
@@ -91,4 +70,20 @@ $dismissModal.on('click', function(event){
 $closeButton.on('click', function(event){
     $('#message-text').val('')
     $('#message-created').remove()
-})
\ No newline at end of file
+})
+
+// event listener for search-as-you-type username suggestions; the list is
+// only on the page for logged-in users
+if ($usernameSuggestions.length){
+    $search.on('input', async function(event){
+        const prefix = $search.val();
+        const usernames = await Suggestion.getSuggestions(prefix);
+        if ($search.val() !== prefix){
+            return;
+        }
+        $usernameSuggestions.empty();
+        for (let username of usernames){
+            $usernameSuggestions.append($('<option>').attr('value', username));
+        }
+    })
+}
@@ -23,13 +23,18 @@ class Like {
 
     constructor(msg_id){
         this.msg_id = msg_id
+        // one key per intent, so retries of this like/unlike are deduplicated
+        this.idempotencyKey = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : `${Date.now()}-${Math.random()}`
     }
 
-    async addremoveLike(){
+    // like (liked = true) or unlike the message with an idempotent PUT/DELETE
+    async addremoveLike(liked){
         try{
-            console.log('starting addremoveLike');
-            const response = await axios.post(`/users/add_like/${this.msg_id}`);
-            console.log('response.data = ', response.data);
+            const response = await axios({
+                method: liked ? 'put' : 'delete',
+                url: `/messages/${this.msg_id}/like`,
+                headers: {'Idempotency-Key': this.idempotencyKey}
+            });
             return response.data;
         } catch(error) {
             $error = $('<div class="alert alert-danger">Like failed</div>')
@@ -38,6 +43,18 @@ class Like {
     }
 }
 
+class Suggestion {
+
+    static async getSuggestions(prefix){
+        try {
+            const response = await axios.get('/users/suggest', {params: {prefix}});
+            return Array.isArray(response.data) ? response.data : [];
+        } catch(error) {
+            return [];
+        }
+    }
+}
+
 
 // write tests for all javascript functions
 
@@ -0,0 +1,126 @@
+"""In-memory prefix index over usernames for the /users/suggest typeahead."""
+
+import bisect
+import os
+import threading
+import time
+from itertools import islice
+
+
+# seconds before a failed background load is tried again
+RETRY_SECONDS = 5
+
+
+class UsernameIndex:
+    """Usernames in a sorted array, searched by prefix with bisect.
+
+    Matching is case-insensitive: entries are (lowercased, original) pairs,
+    so every name sharing a prefix sits in one contiguous run and a lookup is
+    a binary search plus at most `limit` steps. Each worker process keeps its
+    own copy, built at start and patched as usernames are added, changed or
+    removed. Changes made through other workers only arrive when the
+    thread start() runs reloads the whole index, every `ttl` seconds (0:
+    never again), away from the requests.
+    """
+
+    def __init__(self, usernames=None, ttl=0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = []
+        self._loaded = threading.Event()
+        self._loader_pid = None
+        if usernames is not None:
+            self.load(usernames)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self, usernames):
+        """Replace the index contents with `usernames`."""
+
+        entries = sorted((username.lower(), username) for username in usernames)
+        with self._lock:
+            self._entries = entries
+        self._loaded.set()
+
+    def start(self, fetch, app=None):
+        """Load the index from `fetch()` on a background thread, and reload
+        it from there every `ttl` seconds.
+
+        Does nothing if this process's loader is already running, so it can
+        be called at worker start and again wherever the index is used.
+        With `app`, `fetch` runs inside its app context.
+        """
+
+        # a thread doesn't survive a fork (e.g. gunicorn preload), so each
+        # process starts its own loader
+        with self._lock:
+            if self._loader_pid == os.getpid():
+                return
+            self._loader_pid = os.getpid()
+        threading.Thread(target=self._run, args=(fetch, app), name='username-index', daemon=True).start()
+
+    def wait(self, timeout=None):
+        """Wait for the first load; return whether it has happened."""
+
+        return self._loaded.wait(timeout)
+
+    def add(self, username):
+        """Add `username` if it isn't already indexed."""
+
+        entry = (username.lower(), username)
+        with self._lock:
+            i = bisect.bisect_left(self._entries, entry)
+            if i == len(self._entries) or self._entries[i] != entry:
+                self._entries.insert(i, entry)
+
+    def remove(self, username):
+        """Drop `username` from the index if present."""
+
+        entry = (username.lower(), username)
+        with self._lock:
+            i = bisect.bisect_left(self._entries, entry)
+            if i < len(self._entries) and self._entries[i] == entry:
+                del self._entries[i]
+
+    def rename(self, old_username, new_username):
+        """Swap `old_username` for `new_username`."""
+
+        if old_username != new_username:
+            self.remove(old_username)
+            self.add(new_username)
+
+    def suggest(self, prefix, limit=10):
+        """Up to `limit` usernames starting with `prefix`, alphabetically."""
+
+        key = prefix.lower()
+        if not key or limit <= 0:
+            return []
+
+        with self._lock:
+            start = bisect.bisect_left(self._entries, (key,))
+            matches = []
+            for lowered, username in islice(self._entries, start, start + limit):
+                if not lowered.startswith(key):
+                    break
+                matches.append(username)
+        return matches
+
+    def _run(self, fetch, app):
+        while True:
+            try:
+                if app is not None:
+                    with app.app_context():
+                        usernames = fetch()
+                else:
+                    usernames = fetch()
+            except Exception:
+                if app is not None:
+                    app.logger.exception("loading the username index failed")
+                time.sleep(RETRY_SECONDS)
+                continue
+
+            self.load(usernames)
+            if self.ttl <= 0:
+                return
+            time.sleep(self.ttl)
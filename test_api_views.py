@@ -0,0 +1,140 @@
+"""JSON feed API tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_api_views.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class APIViewTestCase(TestCase):
+    """Test the JSON feed routes."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup(username="testuser",
+                                    email="test@test.com",
+                                    password="testuser",
+                                    image_url=None,
+                                    header_image_url=None,
+                                    bio=None,
+                                    location=None)
+        self.testuser2 = User.signup(username="testuser2",
+                                     email="test2@test.com",
+                                     password="testuser",
+                                     image_url=None,
+                                     header_image_url=None,
+                                     bio=None,
+                                     location=None)
+        db.session.commit()
+
+        self.testuser.following.append(self.testuser2)
+        db.session.add_all([Message(text=f"testing {i}", user_id=self.testuser2.id) for i in range(3)])
+        db.session.commit()
+
+    def tearDown(self):
+        """clean up any fouled transactions"""
+
+        db.session.rollback()
+
+    def test_timeline(self):
+        """Does the timeline list messages with a deduplicated author map?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.get('/api/timeline')
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(len(resp.json['messages']), 3)
+            self.assertEqual(set(resp.json['messages'][0]), {'id', 'text', 'ts', 'user_id'})
+            self.assertEqual(list(resp.json['users']), [str(self.testuser2.id)])
+            self.assertIsNone(resp.json['next'])
+
+    def test_timeline_not_modified(self):
+        """Does a repeat request with the ETag get a 304?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            etag = c.get('/api/timeline').headers['ETag']
+            resp = c.get('/api/timeline', headers={'If-None-Match': etag})
+
+            self.assertEqual(resp.status_code, 304)
+
+            db.session.add(Message(text="new", user_id=self.testuser2.id))
+            db.session.commit()
+            resp = c.get('/api/timeline', headers={'If-None-Match': etag})
+
+            self.assertEqual(resp.status_code, 200)
+
+    def test_user_likes(self):
+        """Does the likes feed list the messages a user liked?"""
+        message = db.session.query(Message).filter(Message.text == "testing 0").one()
+        Likes.add(self.testuser.id, message.id)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.get(f'/api/users/{self.testuser.id}/likes')
+
+            self.assertEqual([m['id'] for m in resp.json['messages']], [message.id])
+
+    def test_loggedout(self):
+        """Do the API routes answer 401 when no one is logged in?"""
+        with self.client as c:
+            resp = c.get(f'/api/users/{self.testuser2.id}/messages')
+
+            self.assertEqual(resp.status_code, 401)
+
+    def test_metrics_token(self):
+        """Is /metrics served only to callers with METRICS_TOKEN?"""
+        app.config['METRICS_TOKEN'] = 'secret'
+        try:
+            with self.client as c:
+                resp = c.get('/metrics', headers={'Authorization': 'Bearer secret'})
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn('group_commit', resp.json)
+
+                self.assertEqual(c.get('/metrics').status_code, 401)
+                self.assertEqual(c.get('/metrics', headers={'Authorization': 'Bearer guess'}).status_code, 401)
+
+            app.config['METRICS_TOKEN'] = ''
+            with self.client as c:
+                resp = c.get('/metrics', headers={'Authorization': 'Bearer '})
+                self.assertEqual(resp.status_code, 404)
+        finally:
+            app.config['METRICS_TOKEN'] = ''
@@ -0,0 +1,68 @@
+"""Static asset build tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from assets import Assets
+
+
+class AssetsTestCase(TestCase):
+    """Tests for the fingerprinted, precompressed asset build."""
+
+    def setUp(self):
+        """Make a small static folder to build from."""
+
+        self.static_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.static_dir, 'images'))
+        os.makedirs(os.path.join(self.static_dir, 'stylesheets'))
+        with open(os.path.join(self.static_dir, 'images', 'logo.png'), 'wb') as f:
+            f.write(b'not really a png')
+        with open(os.path.join(self.static_dir, 'stylesheets', 'style.css'), 'w') as f:
+            f.write('nav { background: url("/static/images/logo.png"); }\n' * 50)
+
+        self.assets = Assets()
+        self.assets.static_dir = self.static_dir
+        self.assets.dist_dir = os.path.join(self.static_dir, 'dist')
+
+    def tearDown(self):
+        shutil.rmtree(self.static_dir)
+
+    def test_build(self):
+        """Are files copied under hashed names, with stylesheet URLs rewritten?"""
+
+        self.assets.build()
+        logo = self.assets.lookup('images/logo.png')
+        style = self.assets.lookup('stylesheets/style.css')
+
+        self.assertRegex(logo, r'^images/logo\.[0-9a-f]{12}\.png$')
+        with open(os.path.join(self.assets.dist_dir, style)) as f:
+            self.assertIn(f'/assets/{logo}', f.read())
+
+    def test_precompressed(self):
+        """Are text files gzipped alongside, and images left alone?"""
+
+        self.assets.build()
+        style = os.path.join(self.assets.dist_dir, self.assets.lookup('stylesheets/style.css'))
+        logo = os.path.join(self.assets.dist_dir, self.assets.lookup('images/logo.png'))
+
+        with open(style, 'rb') as original, gzip.open(style + '.gz') as compressed:
+            self.assertEqual(original.read(), compressed.read())
+        self.assertFalse(os.path.exists(logo + '.gz'))
+
+    def test_rebuild_reloads_manifest(self):
+        """Does a second Assets instance find the first one's build?"""
+
+        self.assets.build()
+        other = Assets()
+        other.dist_dir = self.assets.dist_dir
+        other.load()
+
+        self.assertEqual(other.files, self.assets.files)
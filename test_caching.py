@@ -0,0 +1,154 @@
+"""In-process cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_caching.py
+
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from jinja2 import Environment, DictLoader
+
+from caching import UserSnapshotCache, TTLCache, FragmentCache, FragmentCacheExtension, AtomicBytecodeCache
+
+
+class UserSnapshotCacheTestCase(TestCase):
+    """Tests for the per-worker current-user cache."""
+
+    def setUp(self):
+        """Create a cache with a long TTL."""
+
+        self.cache = UserSnapshotCache(ttl=60, maxsize=2)
+
+    def test_get_set(self):
+        """Does a stored snapshot come back?"""
+
+        self.cache.set(1, {'username': 'camden'}, self.cache.version(1))
+
+        self.assertEqual(self.cache.get(1), {'username': 'camden'})
+        self.assertIsNone(self.cache.get(2))
+
+    def test_invalidate(self):
+        """Does invalidate drop the snapshot?"""
+
+        self.cache.set(1, {'username': 'camden'}, self.cache.version(1))
+        self.cache.invalidate(1)
+
+        self.assertIsNone(self.cache.get(1))
+
+    def test_stale_set_ignored(self):
+        """Is a snapshot read before an invalidation refused?"""
+
+        version = self.cache.version(1)
+        self.cache.invalidate(1)
+        self.cache.set(1, {'username': 'old'}, version)
+
+        self.assertIsNone(self.cache.get(1))
+
+    def test_expired(self):
+        """Are snapshots past their TTL ignored?"""
+
+        cache = UserSnapshotCache(ttl=-1)
+        cache.set(1, {'username': 'camden'}, 0)
+
+        self.assertIsNone(cache.get(1))
+
+    def test_maxsize(self):
+        """Does the cache evict the oldest snapshot when full?"""
+
+        for user_id in (1, 2, 3):
+            self.cache.set(user_id, {'id': user_id}, 0)
+
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.get(3), {'id': 3})
+
+
+class TTLCacheTestCase(TestCase):
+    """Tests for the expiring LRU used for idempotency keys."""
+
+    def test_get_set(self):
+        """Does a stored value come back until it expires?"""
+
+        cache = TTLCache(ttl=60)
+        cache.set('key', 'like added')
+
+        self.assertEqual(cache.get('key'), 'like added')
+        self.assertIsNone(TTLCache(ttl=-1).get('key'))
+
+    def test_lru_eviction(self):
+        """Is the least recently used entry evicted first?"""
+
+        cache = TTLCache(ttl=60, maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+
+
+class FragmentCacheTestCase(TestCase):
+    """Tests for the rendered-fragment cache."""
+
+    def test_memory_cap(self):
+        """Are the least recently used fragments dropped to stay under the cap?"""
+
+        cache = FragmentCache(max_bytes=10)
+        cache.set('a', 'a', 'xxxx')
+        cache.set('b', 'b', 'xxxx')
+        cache.get('a')
+        cache.set('c', 'c', 'xxxx')
+
+        self.assertEqual(cache.get('a'), 'xxxx')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 'xxxx')
+
+    def test_invalidate(self):
+        """Does invalidate drop every fragment with the tag, and only those?"""
+
+        cache = FragmentCache(max_bytes=100)
+        cache.set(('home', 1), 1, 'one')
+        cache.set(('show', 1), 1, 'one')
+        cache.set(('home', 2), 2, 'two')
+        cache.invalidate(1)
+
+        self.assertIsNone(cache.get(('home', 1)))
+        self.assertIsNone(cache.get(('show', 1)))
+        self.assertEqual(cache.get(('home', 2)), 'two')
+
+    def test_cache_tag(self):
+        """Is a {% cache %} block rendered once per key, around live markup?"""
+
+        env = Environment(extensions=[FragmentCacheExtension], autoescape=True)
+        env.fragment_cache = FragmentCache(max_bytes=1000)
+        template = env.from_string('{% cache ("message", m.id), v %}<p>{{ m.text }}</p>{% endcache %}{{ liked }}')
+
+        self.assertEqual(template.render(m={'id': 1, 'text': 'a&b'}, v=0, liked=True), '<p>a&amp;b</p>True')
+        self.assertEqual(template.render(m={'id': 1, 'text': 'changed'}, v=0, liked=False), '<p>a&amp;b</p>False')
+        self.assertEqual(template.render(m={'id': 1, 'text': 'changed'}, v=1, liked=False), '<p>changed</p>False')
+
+
+class AtomicBytecodeCacheTestCase(TestCase):
+    """Tests for the shared compiled-template cache."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared_between_environments(self):
+        """Does a second environment load the first one's compiled template?"""
+
+        loader = DictLoader({'page.html': 'Hello {{ name }}'})
+        first = Environment(loader=loader, bytecode_cache=AtomicBytecodeCache(self.directory))
+        first.get_template('page.html')
+
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+        second = Environment(loader=loader, bytecode_cache=AtomicBytecodeCache(self.directory))
+        self.assertEqual(second.get_template('page.html').render(name='warbler'), 'Hello warbler')
@@ -0,0 +1,106 @@
+"""Response compression tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_compression.py
+
+
+import gzip
+from unittest import TestCase
+
+from jinja2 import Environment
+
+from compression import GzipMiddleware, WhitespaceCollapse
+
+
+def make_app(body, content_type='text/html; charset=utf-8', headers=(), chunks=1):
+    """A WSGI app sending `body` in `chunks` pieces, with a Content-Length
+    unless it's sent in more than one."""
+
+    def app(environ, start_response):
+        response_headers = [('Content-Type', content_type), *headers]
+        if chunks == 1:
+            response_headers.append(('Content-Length', str(len(body))))
+        start_response('200 OK', response_headers)
+        size = len(body) // chunks + 1
+        return [body[i:i + size] for i in range(0, len(body), size)]
+    return app
+
+
+def call(app, accept_encoding='gzip, deflate'):
+    """Run `app` once; return its headers and the joined body."""
+
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['headers'] = dict(headers)
+
+    body = b''.join(app({'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': accept_encoding}, start_response))
+    return started['headers'], body
+
+
+class GzipMiddlewareTestCase(TestCase):
+    """Tests for gzipping responses."""
+
+    def test_compresses_html(self):
+        """Is a large HTML response gzipped, with Vary and a weak ETag?"""
+
+        body = b'<li>warble</li>' * 200
+        headers, data = call(GzipMiddleware(make_app(body, headers=[('ETag', '"abc"')])))
+
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(headers['ETag'], 'W/"abc"')
+        self.assertNotIn('Content-Length', headers)
+        self.assertEqual(gzip.decompress(data), body)
+
+    def test_streamed(self):
+        """Is a streamed response compressed chunk by chunk and still whole?"""
+
+        body = b'{"id": 1}' * 500
+        headers, data = call(GzipMiddleware(make_app(body, 'application/json', chunks=5)))
+
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(data), body)
+
+    def test_skips(self):
+        """Are small, non-text, already-encoded and unwanted responses left alone?"""
+
+        body = b'x' * 1000
+        cases = [
+            (make_app(b'tiny'), 'gzip'),
+            (make_app(body, 'image/jpeg'), 'gzip'),
+            (make_app(body, 'text/css', headers=[('Content-Encoding', 'br')]), 'gzip, br'),
+            (make_app(body), 'identity'),
+        ]
+        for app, accept_encoding in cases:
+            headers, data = call(GzipMiddleware(app), accept_encoding)
+            self.assertNotEqual(headers.get('Content-Encoding'), 'gzip')
+
+    def test_vary_without_gzip(self):
+        """Do compressible responses say they vary even when sent plain?"""
+
+        headers, data = call(GzipMiddleware(make_app(b'x' * 1000)), 'identity')
+
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+
+
+class WhitespaceCollapseTestCase(TestCase):
+    """Tests for trimming template whitespace."""
+
+    def test_collapse(self):
+        """Is indentation dropped while words stay apart?"""
+
+        env = Environment(extensions=[WhitespaceCollapse], trim_blocks=True, lstrip_blocks=True)
+        html = env.from_string('<ul>\n    {% for i in items %}\n    <li>{{ i }} warble</li>\n    {% endfor %}\n</ul>\n').render(items=[1, 2])
+
+        self.assertEqual(html, '<ul>\n<li>1 warble</li>\n<li>2 warble</li>\n</ul>')
+
+    def test_keeps_pre_and_textarea(self):
+        """Is whitespace inside <pre> and <textarea> kept as written?"""
+
+        env = Environment(extensions=[WhitespaceCollapse])
+        source = '<div>\n    <pre>a\n    b</pre>\n    <textarea>\n  c\n\n</textarea>\n</div>'
+        html = env.from_string(source).render()
+
+        self.assertEqual(html, '<div>\n<pre>a\n    b</pre>\n<textarea>\n  c\n\n</textarea>\n</div>')
@@ -0,0 +1,96 @@
+"""Group commit tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_group_commit.py
+
+
+import threading
+from concurrent.futures import TimeoutError
+from unittest import TestCase
+
+from group_commit import GroupCommitter
+
+
+class GroupCommitterTestCase(TestCase):
+    """Tests for coalescing concurrent writes."""
+
+    def setUp(self):
+        """Create a committer whose write records each batch."""
+
+        self.batches = []
+
+        def write(rows):
+            if 'bad' in rows:
+                raise ValueError('bad row')
+            self.batches.append(list(rows))
+            return [row.upper() for row in rows]
+
+        self.committer = GroupCommitter(write)
+        self.committer.window = 0.2
+
+    def submit_all(self, rows):
+        results = {}
+
+        def submit(row):
+            try:
+                results[row] = self.committer.submit(row)
+            except ValueError as error:
+                results[row] = error
+
+        threads = [threading.Thread(target=submit, args=(row,)) for row in rows]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_coalesces_concurrent_writes(self):
+        """Do writes submitted within the window share one batch, and does
+        each caller get its own result?"""
+
+        results = self.submit_all(['a', 'b', 'c'])
+
+        self.assertEqual(results, {'a': 'A', 'b': 'B', 'c': 'C'})
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(self.committer.stats()['max_batch_size'], 3)
+
+    def test_max_batch(self):
+        """Are batches capped at max_batch rows?"""
+
+        self.committer.max_batch = 2
+        self.submit_all(['a', 'b', 'c', 'd'])
+
+        self.assertTrue(all(len(batch) <= 2 for batch in self.batches))
+        self.assertEqual(self.committer.stats()['rows'], 4)
+
+    def test_failed_row_is_isolated(self):
+        """Does a failing row fail only its own request?"""
+
+        results = self.submit_all(['a', 'bad', 'c'])
+
+        self.assertIsInstance(results['bad'], ValueError)
+        self.assertEqual(results['a'], 'A')
+        self.assertEqual(results['c'], 'C')
+
+    def test_timeout(self):
+        """Does submit give up when its batch never commits?"""
+
+        release = threading.Event()
+        self.committer.write = lambda rows: release.wait() and rows
+        self.committer.window = 0
+        self.committer.timeout = 0.05
+
+        with self.assertRaises(TimeoutError):
+            self.committer.submit('a')
+        release.set()
+
+    def test_check_workers(self):
+        """Is group commit turned off for workers that serve one request at a time?"""
+
+        self.committer.enabled = True
+        self.committer.check_workers(concurrent=True)
+        self.assertTrue(self.committer.enabled)
+
+        self.committer.check_workers(concurrent=False)
+        self.assertFalse(self.committer.enabled)
@@ -0,0 +1,111 @@
+"""Fixture loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_load.py
+
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import psycopg2
+
+from models import db, User, Message, Follows, Timeline
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import load
+import migrations
+
+db.create_all()
+
+
+def csv_rows(filename):
+    with open(os.path.join('generator', filename)) as f:
+        return sum(1 for _ in f) - 1
+
+
+class LoadTestCase(TestCase):
+    """Tests for the COPY fixture loader."""
+
+    def tearDown(self):
+        db.session.rollback()
+        User.query.delete()
+        db.session.commit()
+
+    def test_load(self):
+        """Are all rows, derived tables and indexes in place after a load?"""
+        lines = []
+        total = load.load(db.engine, report=lines.append)
+
+        self.assertEqual(db.session.query(User).count(), csv_rows('users.csv'))
+        self.assertEqual(db.session.query(Message).count(), csv_rows('messages.csv'))
+        self.assertEqual(db.session.query(Follows).count(), csv_rows('follows.csv'))
+        self.assertEqual(total, csv_rows('users.csv') + csv_rows('messages.csv') + csv_rows('follows.csv'))
+        self.assertGreater(db.session.query(Timeline).count(), 0)
+        self.assertIn('rows/s overall', lines[-1])
+
+        user = db.session.query(User).first()
+        self.assertEqual(user.messages_count, db.session.query(Message).filter(Message.user_id == user.id).count())
+
+        with db.engine.connect() as connection:
+            self.assertEqual(migrations.missing_indexes(connection), [])
+
+    def test_sequences_reset(self):
+        """Can new rows be added after a load without id clashes?"""
+        load.load(db.engine, report=lambda line: None)
+
+        user = User(email='new@test.com', username='newuser', password='password')
+        db.session.add(user)
+        db.session.commit()
+
+        self.assertEqual(user.id, csv_rows('users.csv') + 1)
+
+    def test_bad_header_changes_nothing(self):
+        """Does a CSV with an unknown column fail before the tables are emptied?"""
+        load.load(db.engine, report=lambda line: None)
+        directory = tempfile.mkdtemp()
+        try:
+            for filename in ('users.csv', 'messages.csv', 'follows.csv'):
+                shutil.copy(os.path.join('generator', filename), directory)
+            with open(os.path.join(directory, 'follows.csv'), 'w') as f:
+                f.write('user_being_followed_id,follower\n1,2\n')
+
+            with self.assertRaises(ValueError):
+                load.load(db.engine, directory=directory, report=lambda line: None)
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(db.session.query(User).count(), csv_rows('users.csv'))
+        with db.engine.connect() as connection:
+            self.assertEqual(migrations.missing_indexes(connection), [])
+
+    def test_failed_load_keeps_indexes(self):
+        """Does a load that fails partway raise its own error and still rebuild the indexes?"""
+        directory = tempfile.mkdtemp()
+        try:
+            for filename in ('users.csv', 'messages.csv', 'follows.csv'):
+                shutil.copy(os.path.join('generator', filename), directory)
+            with open(os.path.join(directory, 'messages.csv'), 'w') as f:
+                f.write('text,timestamp,user_id\nhello,2017-01-21 11:04:53,not-a-number\n')
+
+            lines = []
+            with self.assertRaises(psycopg2.DataError):
+                load.load(db.engine, directory=directory, report=lines.append)
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertTrue(any('indexes built' in line for line in lines))
+        with db.engine.connect() as connection:
+            self.assertEqual(migrations.missing_indexes(connection), [])
@@ -9,7 +9,8 @@ import os
 from unittest import TestCase
 from datetime import date
 
-from models import db, User, Message, Follows
+import models
+from models import db, User, Message, Follows, Likes, Timeline
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -60,3 +61,68 @@ class MessageModelTestCase(TestCase):
         self.assertEqual(m.user.username, 'janedoe')
         self.assertEqual(m.text, 'this is a test message')
         self.assertIn(str(date.today()), str(m.timestamp))
+
+    def test_message_fans_out_to_timelines(self):
+        """Does a new message land in the author's and the followers' timelines?"""
+        author = db.session.query(User).filter(User.username=='janedoe').first()
+        follower = User(email='johndoe@gmail.com', username='johndoe', password='password')
+        db.session.add(follower)
+        db.session.commit()
+
+        follower.following.append(author)
+        db.session.commit()
+
+        m = Message(text="fanned out", user_id=author.id)
+        db.session.add(m)
+        db.session.commit()
+
+        owners = {t.user_id for t in db.session.query(Timeline).filter(Timeline.message_id == m.id)}
+        self.assertEqual(owners, {author.id, follower.id})
+
+    def test_timeline_for(self):
+        """Does timeline_for return own and followed users' messages only?"""
+        jane = db.session.query(User).filter(User.username=='janedoe').first()
+        john = User(email='johndoe@gmail.com', username='johndoe', password='password')
+        jim = User(email='jimdoe@gmail.com', username='jimdoe', password='password')
+        db.session.add_all([john, jim])
+        db.session.commit()
+
+        jane.following.append(john)
+        db.session.add_all([
+            Message(text="from jane", user_id=jane.id),
+            Message(text="from john", user_id=john.id),
+            Message(text="from jim", user_id=jim.id),
+        ])
+        db.session.commit()
+
+        texts = {m.text for m in Message.timeline_for(jane.id)}
+        self.assertEqual(texts, {"from jane", "from john"})
+
+    def test_like_counts(self):
+        """Are like counts kept on the message and summed across shards once hot?"""
+        jane = db.session.query(User).filter(User.username=='janedoe').first()
+        fans = [User(email=f'fan{i}@gmail.com', username=f'fan{i}', password='password') for i in range(3)]
+        m = Message(text="popular", user_id=jane.id)
+        db.session.add_all(fans + [m])
+        db.session.commit()
+
+        Likes.add(fans[0].id, m.id)
+        db.session.commit()
+        self.assertEqual(Message.like_counts([m.id]), {m.id: 1})
+
+        hot = models.HOT_MESSAGE_LIKES
+        models.HOT_MESSAGE_LIKES = 1
+        try:
+            Likes.add(fans[1].id, m.id)
+            Likes.add(fans[2].id, m.id)
+            Likes.remove(fans[0].id, m.id)
+            db.session.commit()
+        finally:
+            models.HOT_MESSAGE_LIKES = hot
+
+        self.assertEqual(Message.like_counts([m.id]), {m.id: 2})
+
+        Message.fold_like_counts(db.session.connection())
+        db.session.commit()
+        db.session.refresh(m)
+        self.assertEqual(m.like_count, 2)
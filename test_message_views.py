@@ -8,7 +8,7 @@
 import os
 from unittest import TestCase
 
-from models import db, connect_db, Message, User
+from models import db, connect_db, Message, User, Likes
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -91,6 +91,33 @@ class MessageViewTestCase(TestCase):
             msg = db.session.query(Message).filter(Message.text == "Hello").first()
             self.assertEqual(msg.text, "Hello")
 
+    def test_add_message_batch(self):
+        """Does a batch insert every message and return their ids in order?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.post("/messages/batch", json=["first", "second", "third"])
+
+            self.assertEqual(resp.status_code, 201)
+            texts = [db.session.query(Message).get(id).text for id in resp.json['ids']]
+            self.assertEqual(texts, ["first", "second", "third"])
+            self.assertEqual(db.session.query(User).get(self.testuser.id).messages_count, 4)
+
+    def test_add_message_batch_invalid(self):
+        """Is a batch with an over-long message rejected as a whole?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.post("/messages/batch", json=["fine", "x" * 141])
+
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(resp.json['invalid'], [1])
+            self.assertIsNone(db.session.query(Message).filter(Message.text == "fine").first())
+
     def test_add_message_loggedout(self):
         """Does site recognize when no one is logged in?"""
         with self.client as c:
@@ -125,6 +152,39 @@ class MessageViewTestCase(TestCase):
             self.assertIn('fa-thumbs-up', html)
             self.assertNotIn('Delete', html)
              
+    def test_view_message_not_modified(self):
+        """Does a repeat view with the message's ETag get a 304, and a new
+        tag once the viewer likes it?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            msg = db.session.query(Message).filter(Message.text == "testing 2").first()
+            etag = c.get(f'/messages/{msg.id}').headers['ETag']
+            resp = c.get(f'/messages/{msg.id}', headers={'If-None-Match': etag})
+
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.headers['Cache-Control'], 'private, no-cache')
+
+            c.put(f'/messages/{msg.id}/like')
+            resp = c.get(f'/messages/{msg.id}', headers={'If-None-Match': etag})
+
+            self.assertEqual(resp.status_code, 200)
+
+    def test_view_message_viewer_renamed(self):
+        """Does the ETag change when the viewer edits the profile shown in the nav bar?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            msg = db.session.query(Message).filter(Message.text == "testing 2").first()
+            etag = c.get(f'/messages/{msg.id}').headers['ETag']
+            c.post('/users/profile', data={'username': 'renamed', 'password': 'testuser', 'email': 'test@test.com'})
+            resp = c.get(f'/messages/{msg.id}', headers={'If-None-Match': etag})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('renamed', resp.get_data(as_text=True))
+
     def test_view_message_loggedout(self):
         """Does site respond appropriately when a logged out user tries to view a message?"""
         with self.client as c:
@@ -162,6 +222,57 @@ class MessageViewTestCase(TestCase):
             self.assertNotIn('fa-thumbs-up', html)
             self.assertIn('Delete', html)
 
+    def test_put_like_idempotent(self):
+        """Does liking twice leave one like and answer the same way?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            msg = db.session.query(Message).filter(Message.text == "testing 2").first()
+            first = c.put(f'/messages/{msg.id}/like', headers={'Idempotency-Key': 'abc'})
+            second = c.put(f'/messages/{msg.id}/like')
+
+            self.assertEqual(first.json, 'like added')
+            self.assertEqual(second.json, 'like added')
+            self.assertEqual(db.session.query(Likes).filter(Likes.message_id == msg.id).count(), 1)
+
+    def test_delete_like_idempotent(self):
+        """Does unliking twice leave no like and answer the same way?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            msg = db.session.query(Message).filter(Message.text == "testing 2").first()
+            c.put(f'/messages/{msg.id}/like')
+            first = c.delete(f'/messages/{msg.id}/like')
+            second = c.delete(f'/messages/{msg.id}/like')
+
+            self.assertEqual(first.json, 'like removed')
+            self.assertEqual(second.json, 'like removed')
+            self.assertEqual(db.session.query(Likes).filter(Likes.message_id == msg.id).count(), 0)
+
+    def test_put_like_own_message(self):
+        """Does the site refuse a like of the user's own message?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            msg = db.session.query(Message).filter(Message.text == "testing 1").first()
+            resp = c.put(f'/messages/{msg.id}/like')
+
+            self.assertEqual(resp.json, 'request failed')
+
+    def test_put_like_loggedout(self):
+        """Does a logged-out like get a 401 JSON error rather than a redirect?"""
+        with self.client as c:
+            msg = db.session.query(Message).filter(Message.text == "testing 2").first()
+            resp = c.put(f'/messages/{msg.id}/like')
+
+            self.assertEqual(resp.status_code, 401)
+            self.assertEqual(resp.json, {'error': 'unauthorized'})
+            with c.session_transaction() as sess:
+                self.assertNotIn('_flashes', sess)
+
     def test_delete_message(self):
         """Does the site delete messages correctly?"""
         with self.client as c:
@@ -0,0 +1,48 @@
+"""Schema migration tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_migrations.py
+
+
+import os
+from unittest import TestCase
+
+from models import db
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import migrations
+
+db.create_all()
+
+
+class MigrationsTestCase(TestCase):
+    """Tests for the migration runner and index check."""
+
+    def test_versions_are_ordered(self):
+        """Are migration versions unique and increasing?"""
+        versions = [version for version, _, _ in migrations.MIGRATIONS]
+
+        self.assertEqual(versions, sorted(set(versions)))
+
+    def test_upgrade_applies_everything(self):
+        """Does upgrade leave no migrations pending?"""
+        with db.engine.connect() as connection:
+            migrations.upgrade(connection)
+
+            self.assertEqual(migrations.pending_migrations(connection), [])
+
+    def test_no_missing_indexes(self):
+        """Does a database built from the models have every declared index?"""
+        with db.engine.connect() as connection:
+            self.assertEqual(migrations.missing_indexes(connection), [])
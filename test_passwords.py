@@ -0,0 +1,61 @@
+"""Password hashing pool tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+from types import SimpleNamespace
+from unittest import TestCase
+
+from passwords import PasswordHasher, PasswordQueueFull
+
+
+class PasswordHasherTestCase(TestCase):
+    """Tests for the bounded bcrypt pool."""
+
+    def setUp(self):
+        """Create a hasher with a cheap cost and a single pool process."""
+
+        self.hasher = PasswordHasher()
+        self.hasher.rounds = 4
+        self.hasher.pool_size = 1
+
+    def test_hash_and_check(self):
+        """Does a hash made in the pool verify, and reject a wrong password?"""
+
+        hashed = self.hasher.hash('testing')
+
+        self.assertTrue(self.hasher.check(hashed, 'testing'))
+        self.assertFalse(self.hasher.check(hashed, 'wrong'))
+
+    def test_needs_rehash(self):
+        """Does needs_rehash spot hashes made at another cost?"""
+
+        hashed = self.hasher.hash('testing')
+
+        self.assertFalse(self.hasher.needs_rehash(hashed))
+        self.hasher.rounds = 5
+        self.assertTrue(self.hasher.needs_rehash(hashed))
+
+    def test_stats(self):
+        """Are completed jobs and latency recorded?"""
+
+        self.hasher.hash('testing')
+        stats = self.hasher.stats()
+
+        self.assertEqual(stats['completed'], 1)
+        self.assertEqual(stats['waiting'], 0)
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(stats['rejected'], 0)
+        self.assertGreater(stats['max_latency_ms'], 0)
+
+    def test_full(self):
+        """Is a job refused, not queued, when there's no room for it?"""
+
+        self.hasher.init_app(SimpleNamespace(config={'BCRYPT_LOG_ROUNDS': 4, 'BCRYPT_POOL_SIZE': 0,
+                                                     'BCRYPT_MAX_QUEUE': 0}))
+
+        with self.assertRaises(PasswordQueueFull):
+            self.hasher.hash('testing')
+        self.assertEqual(self.hasher.stats()['rejected'], 1)
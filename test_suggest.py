@@ -0,0 +1,90 @@
+"""Username prefix index tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_suggest.py
+
+
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from suggest import UsernameIndex
+
+
+class UsernameIndexTestCase(TestCase):
+    """Tests for the in-memory username prefix index."""
+
+    def setUp(self):
+        """Build an index over a few usernames."""
+
+        self.index = UsernameIndex(['camdentadhg', 'Camila', 'dianabright', 'cam', 'amandamacomber'])
+
+    def test_suggest(self):
+        """Does suggest return matching names in order, case-insensitively?"""
+
+        self.assertEqual(self.index.suggest('CAM'), ['cam', 'camdentadhg', 'Camila'])
+        self.assertEqual(self.index.suggest('di'), ['dianabright'])
+        self.assertEqual(self.index.suggest('zed'), [])
+
+    def test_suggest_limit(self):
+        """Does suggest respect the result limit?"""
+
+        self.assertEqual(self.index.suggest('cam', limit=2), ['cam', 'camdentadhg'])
+
+    def test_suggest_empty_prefix(self):
+        """Does an empty prefix return nothing rather than everyone?"""
+
+        self.assertEqual(self.index.suggest(''), [])
+
+    def test_add_remove(self):
+        """Do add and remove keep the index current without duplicates?"""
+
+        self.index.add('dianaross')
+        self.index.add('dianaross')
+        self.index.remove('dianabright')
+
+        self.assertEqual(self.index.suggest('diana'), ['dianaross'])
+        self.assertEqual(len(self.index), 5)
+
+    def test_rename(self):
+        """Does rename move a username to its new place?"""
+
+        self.index.rename('amandamacomber', 'mandy')
+
+        self.assertEqual(self.index.suggest('aman'), [])
+        self.assertEqual(self.index.suggest('man'), ['mandy'])
+
+    def test_start(self):
+        """Does start load the index in the background, and reload it every ttl?"""
+
+        loads = iter([['cam'], ['dianabright']])
+        index = UsernameIndex(ttl=0.05)
+        index.start(lambda: next(loads, ['dianabright']))
+        index.start(lambda: ['ignored'])
+
+        self.assertTrue(index.wait(1))
+        deadline = time.monotonic() + 1
+        while index.suggest('di') == [] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(index.suggest('di'), ['dianabright'])
+        self.assertEqual(index.suggest('cam'), [])
+
+    def test_start_failed(self):
+        """Is a failed load tried again?"""
+
+        attempts = []
+
+        def fetch():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RuntimeError('database unavailable')
+            return ['cam']
+
+        index = UsernameIndex()
+        with patch('suggest.RETRY_SECONDS', 0.01):
+            index.start(fetch)
+            self.assertTrue(index.wait(1))
+
+        self.assertEqual(index.suggest('cam'), ['cam'])
+        self.assertEqual(len(attempts), 2)
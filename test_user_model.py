@@ -9,7 +9,7 @@ import os
 from unittest import TestCase
 from sqlalchemy.exc import IntegrityError
 
-from models import db, User, Message, Follows
+from models import db, passwords, User, Message, Follows
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -134,6 +134,52 @@ class UserModelTestCase(TestCase):
 
         self.assertFalse(camden.is_following(amanda))
 
+    def test_following_ids(self):
+        """Does following_ids return just the followed users among those asked about?"""
+
+        camden = db.session.query(User).filter(User.username == 'camdentadhg').first()
+        diana = db.session.query(User).filter(User.username == 'dianabright').first()
+        amanda = db.session.query(User).filter(User.username == 'amandamacomber').first()
+
+        self.assertEqual(camden.following_ids([diana.id, amanda.id]), {diana.id})
+        self.assertEqual(camden.following_ids([]), set())
+
+    def test_counters(self):
+        """Do the denormalized counters follow follows, messages and likes?"""
+
+        camden = db.session.query(User).filter(User.username == 'camdentadhg').first()
+        diana = db.session.query(User).filter(User.username == 'dianabright').first()
+
+        self.assertEqual(camden.followers_count, 1)
+        self.assertEqual(camden.following_count, 1)
+
+        m = Message(text='counted', user_id=diana.id)
+        db.session.add(m)
+        db.session.commit()
+        camden.likes.append(m)
+        db.session.commit()
+
+        self.assertEqual(diana.messages_count, 1)
+        self.assertEqual(camden.likes_count, 1)
+
+        db.session.delete(m)
+        db.session.commit()
+
+        self.assertEqual(diana.messages_count, 0)
+        self.assertEqual(camden.likes_count, 0)
+
+    def test_reconcile_counters(self):
+        """Does reconcile_counters repair drifted counters?"""
+
+        camden = db.session.query(User).filter(User.username == 'camdentadhg').first()
+        camden.followers_count = 42
+        db.session.commit()
+
+        User.reconcile_counters(db.session.connection())
+        db.session.commit()
+
+        self.assertEqual(camden.followers_count, 1)
+
     def test_signup_correct(self):
         """Does signup correctly create a user when the appropriate data is given?"""
 
@@ -212,4 +258,21 @@ class UserModelTestCase(TestCase):
         test_user = User.authenticate(username='camdentadhg2', password='password')
 
         self.assertNotIsInstance(test_user, User)
-        self.assertFalse(test_user)
\ No newline at end of file
+        self.assertFalse(test_user)
+
+    def test_authenticate_rehash(self):
+        """Does authenticate upgrade a hash made at a different bcrypt cost?"""
+
+        u = User.signup(username='camdentadhg2', email='camdent@gmail.com', password='testing',image_url=None, header_image_url=None, bio=None, location=None)
+        db.session.commit()
+        old_hash = u.password
+
+        rounds = passwords.rounds
+        passwords.rounds = rounds - 1
+        try:
+            test_user = User.authenticate(username='camdentadhg2', password='testing')
+        finally:
+            passwords.rounds = rounds
+
+        self.assertNotEqual(test_user.password, old_hash)
+        self.assertEqual(test_user.password.split('$')[2], f'{rounds - 1:02}')
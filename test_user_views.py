@@ -5,12 +5,14 @@
 #    FLASK_ENV=production python -m unittest test_user_views.py
 
 
+import logging
 import os
 from unittest import TestCase
-from app import do_login, do_logout, add_user_to_g
+from app import do_login, do_logout, add_user_to_g, load_authors, static_url, asset_url, preload_templates
 from flask import g, session
+from sqlalchemy import event
 
-from models import db, connect_db, Message, User
+from models import db, connect_db, Message, User, Likes
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -22,7 +24,7 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 # Now we can import app
 
-from app import app, CURR_USER_KEY
+from app import app, CURR_USER_KEY, username_index
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -104,6 +106,81 @@ class UserViewTestCase(TestCase):
             # testing presence of followed user's message
             self.assertIn('testing 2', html)
 
+    def test_homepage_after_stop_following(self):
+        """Does the home page drop a user's messages once they are unfollowed?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.post(f'/users/stop-following/{self.testuser2.id}')
+            resp = c.get('/')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('testing 1', html)
+            self.assertNotIn('testing 2', html)
+
+    def test_homepage_pagination(self):
+        """Does the home page page through older messages with a cursor?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+            db.session.add_all([Message(text=f"paged {i}", user_id=self.testuser.id) for i in range(25)])
+            db.session.commit()
+
+            resp = c.get('/')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Load older', html)
+            self.assertIn('paged 24', html)
+            self.assertNotIn('testing 1', html)
+
+            cursor = html.split('?before=')[1].split('"')[0]
+            resp = c.get(f'/?before={cursor}')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('testing 1', html)
+            self.assertNotIn('paged 24', html)
+            self.assertNotIn('Load older', html)
+
+    def test_homepage_streamed(self):
+        """Does the streamed home page show the same page and cursor?"""
+        app.config['STREAM_FEEDS'] = True
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser.id
+                db.session.add_all([Message(text=f"paged {i}", user_id=self.testuser.id) for i in range(25)])
+                db.session.commit()
+
+                resp = c.get('/')
+                self.assertTrue(resp.is_streamed)
+                html = resp.get_data(as_text=True)
+
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn('paged 24', html)
+                self.assertNotIn('testing 1', html)
+
+                cursor = html.split('?before=')[1].split('"')[0]
+                html = c.get(f'/?before={cursor}').get_data(as_text=True)
+
+                self.assertIn('testing 1', html)
+                self.assertNotIn('Load older', html)
+        finally:
+            app.config['STREAM_FEEDS'] = False
+
+    def test_homepage_bad_cursor(self):
+        """Does the home page reject a malformed cursor?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.get('/?before=yesterday')
+
+            self.assertEqual(resp.status_code, 400)
+
     def test_do_login(self):
         """Does do_login function work?"""
         with app.test_request_context():
@@ -132,6 +209,68 @@ class UserViewTestCase(TestCase):
 
                 self.assertEqual(g.user, self.testuser)
 
+    def test_load_authors(self):
+        """Does load_authors attach every message's author without lazy loads?"""
+        with app.test_request_context():
+            db.session.expire_all()
+            messages = db.session.query(Message).order_by(Message.id).all()
+            load_authors(messages)
+
+            for message in messages:
+                self.assertNotIn('user', db.inspect(message).unloaded)
+            self.assertEqual([m.user.username for m in messages], ['testuser', 'testuser2'])
+
+    def test_add_user_to_g_cached(self):
+        """Does a cached snapshot of the user stand in for the database row?"""
+        with app.test_request_context():
+            with self.client as c:
+                with c.session_transaction() as session:
+                    session[CURR_USER_KEY] = self.testuser.id
+                add_user_to_g()
+                db.session.expunge_all()
+                add_user_to_g()
+
+                self.assertEqual(g.user.id, self.testuser.id)
+                self.assertEqual(g.user.username, 'testuser')
+
+    def test_add_user_to_g_cached_no_select(self):
+        """Does a cache hit load the user without querying users, and the
+        counters only when they're used?"""
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with app.test_request_context():
+            with self.client as c:
+                with c.session_transaction() as session:
+                    session[CURR_USER_KEY] = self.testuser.id
+                add_user_to_g()
+                db.session.expunge_all()
+
+                event.listen(db.engine, 'before_cursor_execute', record)
+                try:
+                    add_user_to_g()
+                    self.assertEqual(g.user.username, 'testuser')
+                    self.assertEqual([s for s in statements if 'FROM users' in s], [])
+
+                    self.assertEqual(g.user.following_count, 1)
+                    self.assertEqual(len([s for s in statements if 'FROM users' in s]), 1)
+                finally:
+                    event.remove(db.engine, 'before_cursor_execute', record)
+
+    def test_profile_invalidates_cached_user(self):
+        """Does editing the profile refresh the cached user?"""
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser.id
+            c.get('/')
+            c.post('/users/profile', data={'username': 'renamed', 'password': 'testuser', 'email': 'test@test.com'})
+            resp = c.get('/')
+            html = resp.get_data(as_text=True)
+
+            self.assertIn('@renamed', html)
+
     def test_signup_get(self):
         """If there is no valid form submission, does the site display the signup form?"""
         with self.client as c:
@@ -394,6 +533,113 @@ class UserViewTestCase(TestCase):
             self.assertNotIn('@testuser2', html)          
 
 
+    def test_list_users_search_ranked(self):
+        """Does search list the closest username match first?"""
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser.id
+            db.session.add_all([
+                User(username='janedoe_fan_club', email='fans@test.com', password='HASHED_PASSWORD'),
+                User(username='jane', email='jane@test.com', password='HASHED_PASSWORD'),
+            ])
+            db.session.commit()
+            resp = c.get('/users?q=jane')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertLess(html.index('@jane<'), html.index('@janedoe_fan_club'))
+
+    def test_list_users_paged(self):
+        """Does the user list page through users a page at a time?"""
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser.id
+            db.session.add_all([
+                User(username=f'zz{i:02}', email=f'zz{i}@test.com', password='HASHED_PASSWORD') for i in range(30)
+            ])
+            db.session.commit()
+            resp = c.get('/users')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('More users', html)
+            self.assertNotIn('@zz29', html)
+
+            resp = c.get('/users?after=zz21')
+            html = resp.get_data(as_text=True)
+
+            self.assertIn('@zz29', html)
+            self.assertNotIn('More users', html)
+
+    def test_suggest_usernames(self):
+        """Does the typeahead endpoint return usernames by prefix?"""
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser.id
+            c.get('/')
+            username_index.add('testuser')
+            username_index.add('testuser2')
+            resp = c.get('/users/suggest?prefix=TESTU')
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json, ['testuser', 'testuser2'])
+
+    def test_suggest_usernames_logged_out(self):
+        """Does the typeahead endpoint answer 401, not a redirect, when logged out?"""
+        with self.client as c:
+            resp = c.get('/users/suggest?prefix=test')
+
+            self.assertEqual(resp.status_code, 401)
+            self.assertEqual(resp.json, {'error': 'unauthorized'})
+
+    def test_users_show_cache_headers(self):
+        """Are other users' profiles cached briefly, and your own and redirects not at all?"""
+        with self.client as c:
+            resp = c.get(f'/users/{self.testuser2.id}')
+            self.assertEqual(resp.headers['Cache-Control'], 'private, no-cache')
+
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.get(f'/users/{self.testuser2.id}')
+            self.assertEqual(resp.headers['Cache-Control'], 'private, max-age=30')
+            resp = c.get(f'/users/{self.testuser.id}')
+            self.assertEqual(resp.headers['Cache-Control'], 'private, no-cache')
+
+    def test_fingerprinted_static_cached(self):
+        """Are fingerprinted static URLs cached for good and plain ones revalidated?"""
+        with app.test_request_context():
+            url = static_url('app.js')
+
+        self.assertIn('?v=', url)
+        with self.client as c:
+            self.assertIn('immutable', c.get(url).headers['Cache-Control'])
+            self.assertEqual(c.get('/static/app.js').headers['Cache-Control'], 'public, no-cache')
+
+            resp = c.get('/static/app.js?v=0123456789ab')
+            self.assertEqual(resp.headers['Cache-Control'], 'public, no-cache')
+
+            resp = c.get('/static/missing.js?v=0123456789ab')
+            self.assertEqual(resp.status_code, 404)
+            self.assertNotIn('immutable', resp.headers['Cache-Control'])
+
+    def test_preload_templates_reported(self):
+        """Is the template preload report logged at a level that is shown?"""
+        # assertLogs lowers the level itself, so check the real one first
+        self.assertTrue(app.logger.isEnabledFor(logging.INFO))
+
+        with self.assertLogs(app.logger, logging.INFO) as logs:
+            preload_templates()
+
+        self.assertRegex(logs.output[0], r'preloaded \d+ templates in')
+
+    def test_asset_url_stays_in_static(self):
+        """Are image URLs outside static/ passed through without being read?"""
+        with app.test_request_context():
+            for url in ['/etc/passwd', '/static/../app.py', 'https://example.com/a.jpg', '../app.py']:
+                self.assertEqual(asset_url(url), url)
+            self.assertIn('?v=', asset_url('/static/images/warbler-hero.jpg'))
+
     def test_users_show_loggedout(self):
         """Does the site deny access to a user record to an anonymous user"""
         with self.client as c:
@@ -424,6 +670,20 @@ class UserViewTestCase(TestCase):
             self.assertIn('@testuser2', html)
             self.assertIn('testing 2', html)
 
+    def test_users_show_liked_state(self):
+        """Does a profile page mark the messages the viewer has liked?"""
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser2.id
+            resp = c.get(f'/users/{self.testuser.id}')
+            html = resp.get_data(as_text=True)
+
+            like_form = html.split(f'/users/add_like/{self.msg1.id}')[1].split('</form>')[0]
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('btn-primary', like_form)
+            self.assertNotIn('btn-secondary', like_form)
+
     def test_users_show_not_found(self):
         """Does the user see a 404 page if the user is not found for a profile page?"""
         with self.client as c:
@@ -461,6 +721,19 @@ class UserViewTestCase(TestCase):
             resp = c.get(f'/users/{testuser.id}/following')
             html = resp.get_data(as_text=True)
 
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('@testuser2', html)
+            # the buttons are for the viewer, who doesn't follow anyone here
+            self.assertNotIn('Unfollow', html)
+
+    def test_show_own_following(self):
+        """Can the user unfollow people from their own following list?"""
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser.id
+            resp = c.get(f'/users/{self.testuser.id}/following')
+            html = resp.get_data(as_text=True)
+
             self.assertEqual(resp.status_code, 200)
             self.assertIn('@testuser2', html)
             self.assertIn('Unfollow', html)
@@ -805,6 +1078,29 @@ class UserViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn('like removed', data)
 
+    def test_add_remove_likes_own_message(self):
+        """Does the site refuse to let a user like their own message?"""
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser.id
+            resp = c.post(f'/users/add_like/{self.msg1.id}')
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('request failed', resp.json)
+
+    def test_add_remove_likes_shared_message(self):
+        """Can two users like the same message?"""
+        with self.client as c:
+            testuser3 = User.signup(username='testuser3', email='test3@test.com', password='testuser', image_url=None, header_image_url=None, bio=None, location=None)
+            db.session.commit()
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = testuser3.id
+            resp = c.post(f'/users/add_like/{self.msg1.id}')
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('like added', resp.json)
+            self.assertEqual(db.session.query(Likes).filter(Likes.message_id == self.msg1.id).count(), 2)
+
     def test_delete_user_loggedout(self):
         """Does the site stop an anonymous user from deleting a user?"""
         with self.client as c: